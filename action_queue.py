@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from enum import IntEnum
+from typing import List, TYPE_CHECKING
+
+import numpy as np
+
+from actions import Action, MeleeAction, MovementAction, WaitAction
+from combat import resolve_melee
+
+if TYPE_CHECKING:
+    from entity import Actor
+    from game_map import GameMap
+
+
+class IntentKind(IntEnum):
+    """Kind of the actions an ActionQueue holds"""
+    WAIT = 0
+    MOVE = 1
+    MELEE = 2
+
+
+class ActionQueue:
+    """
+    Collects the actions the AIs decide on during an enemy turn into NumPy arrays,
+    then resolves all of them in one batched pass.
+    Every AI decides on the state from the start of the pass, so moves may conflict:
+    when several actors step onto the same tile only the first one submitted moves,
+    and actors stepping onto a tile which is being vacated move once it is free.
+    """
+    def __init__(self, capacity: int = 64):
+        self.actions: List[Action] = []
+        self.actors: List[Actor] = []
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.dx = np.zeros(capacity, dtype=np.int8)
+        self.dy = np.zeros(capacity, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.actors)
+
+    def submit(self, action: Action):
+        """Queues the action, only waiting, moving and melee actions can be queued"""
+        if isinstance(action, MeleeAction):
+            kind = IntentKind.MELEE
+        elif isinstance(action, MovementAction):
+            kind = IntentKind.MOVE
+        elif isinstance(action, WaitAction):
+            kind = IntentKind.WAIT
+        else:
+            raise TypeError(f"{type(action).__name__} can't be queued")
+
+        index = len(self.actors)
+        if index == len(self.kind):
+            self.kind = np.resize(self.kind, index * 2)
+            self.dx = np.resize(self.dx, index * 2)
+            self.dy = np.resize(self.dy, index * 2)
+        self.actions.append(action)
+        self.actors.append(action.entity)
+        self.kind[index] = kind
+        self.dx[index] = getattr(action, "dx", 0)
+        self.dy[index] = getattr(action, "dy", 0)
+
+    def clear(self):
+        self.actions.clear()
+        self.actors.clear()
+
+    def resolve(self, game_map: GameMap):
+        """Performs the queued actions and empties the queue. Attacks land before anyone moves"""
+        count = len(self.actors)
+        if count <= 1:
+            # A single action can't conflict with any other, performing it directly saves the array passes.
+            for action in self.actions:
+                action.perform()
+            self.clear()
+            return
+        kind, dx, dy = self.kind[:count], self.dx[:count], self.dy[:count]
+
+        # All the attacks are resolved in one batched combat stage.
+        attackers, targets = [], []
+        for index in np.flatnonzero(kind == IntentKind.MELEE).tolist():
+            actor = self.actors[index]
+            target = game_map.get_actor_at_location(actor.x + int(dx[index]), actor.y + int(dy[index]))
+            if actor.is_alive and target:
+                attackers.append(actor)
+                targets.append(target)
+        resolve_melee(game_map.engine, attackers, targets)
+
+        pending = np.flatnonzero(kind == IntentKind.MOVE)
+        if pending.size:
+            slots = np.array([self.actors[index]._slot for index in pending.tolist()], dtype=np.intp)
+            dest_x = game_map.store.x[slots] + dx[pending]
+            dest_y = game_map.store.y[slots] + dy[pending]
+            valid = (dest_x >= 0) & (dest_x < game_map.width) & (dest_y >= 0) & (dest_y < game_map.height)
+            valid[valid] = game_map.tiles["walkable"][dest_x[valid], dest_y[valid]]
+            pending, dest_x, dest_y = pending[valid], dest_x[valid], dest_y[valid]
+
+        # Each pass moves the first actor submitted onto every free destination,
+        # the others retry as long as the previous pass has freed some tiles.
+        while pending.size:
+            free = game_map.occupancy[dest_x, dest_y] == 0
+            if not free.any():
+                break
+            _, first = np.unique((dest_x * game_map.height + dest_y)[free], return_index=True)
+            moving = np.zeros(pending.size, dtype=bool)
+            moving[np.flatnonzero(free)[first]] = True
+            for index in pending[moving].tolist():
+                self.actors[index].move(int(dx[index]), int(dy[index]))
+            pending, dest_x, dest_y = pending[~moving], dest_x[~moving], dest_y[~moving]
+
+        self.clear()
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
-import color
+from combat import resolve_melee
 
 if TYPE_CHECKING:
     from entity import Entity, Actor
@@ -75,23 +75,7 @@ class MeleeAction(ActionWithDirection):
         if not target:
             return
 
-        damage = self.entity.fighter.power - target.fighter.defense
-
-        attack_desc = f"{self.entity.name.capitalize()} attacks {target.name}"
-        if self.entity is self.engine.player:
-            attack_color = color.player_atk
-        else:
-            attack_color = color.enemy_atk
-
-        if damage > 0:
-            self.engine.message_log.add_message(
-                f"{attack_desc} for {damage} points!", attack_color
-            )
-            target.fighter.hp -= damage
-        else:
-            self.engine.message_log.add_message(
-                f"{attack_desc} but does no damage.", attack_color
-            )
+        resolve_melee(self.engine, [self.entity], [target])
 
 
 class MovementAction(ActionWithDirection):
@@ -0,0 +1,61 @@
+"""
+Benchmark of the movement turn time against the number of entities on the map.
+Every actor tries to bump into a random direction once per turn, which exercises
+GameMap.get_blocking_entity_at_location and GameMap.get_actor_at_location.
+
+Run from the repository root with: python -m benchmarks.entity_lookup
+"""
+import random
+import time
+
+import entity_factories
+import tile_types
+from actions import BumpAction
+from engine import Engine
+from game_map import GameMap
+
+MAP_SIZE = 200
+ENTITY_COUNTS = (100, 500, 1000, 5000)
+TURNS = 20
+
+DIRECTIONS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+
+def build_map(entity_count: int, rng: random.Random):
+    """Returns an engine with an open map crowded with entity_count orcs"""
+    player = entity_factories.player.build()
+    engine = Engine(player)
+    engine.game_map = GameMap(engine, MAP_SIZE, MAP_SIZE)
+    engine.game_map.tiles[1:-1, 1:-1] = tile_types.floor
+    player.place(MAP_SIZE // 2, MAP_SIZE // 2, engine.game_map)
+
+    while len(engine.game_map.entities) <= entity_count:
+        x = rng.randint(1, MAP_SIZE - 2)
+        y = rng.randint(1, MAP_SIZE - 2)
+        if not engine.game_map.get_blocking_entity_at_location(x, y):
+            entity_factories.orc.spawn(engine.game_map, x, y)
+
+    return engine
+
+
+def time_turns(engine: Engine, rng: random.Random):
+    """Returns the average time of a turn in which every actor bumps once"""
+    actors = list(engine.game_map.actors)
+    start = time.perf_counter()
+    for _ in range(TURNS):
+        for actor in actors:
+            BumpAction(actor, *rng.choice(DIRECTIONS)).perform()
+    return (time.perf_counter() - start) / TURNS
+
+
+def main():
+    rng = random.Random(0)
+    print(f"{'entities':>10} {'ms/turn':>10} {'us/actor':>10}")
+    for entity_count in ENTITY_COUNTS:
+        engine = build_map(entity_count, rng)
+        turn_time = time_turns(engine, rng)
+        print(f"{entity_count:>10} {turn_time * 1e3:>10.3f} {turn_time / entity_count * 1e6:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
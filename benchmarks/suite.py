@@ -0,0 +1,116 @@
+"""
+Benchmark suite of the game loop, run headless at several map sizes and monster densities.
+Reports turns per second and the time of dungeon generation, FOV, pathfinding and rendering.
+
+Run from the repository root with: python -m benchmarks.suite [--json] [--profile-dir DIR]
+"""
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+from typing import Optional
+
+import tcod
+
+from camera import Camera
+from components.ai import DistanceMap
+from headless import HeadlessDriver, random_policy
+from level_cache import LevelParams
+
+# (map width, map height, max rooms)
+MAP_SIZES = ((80, 43, 30), (200, 200, 300), (500, 500, 2000))
+MONSTER_DENSITIES = (2, 8)  # Maximum monsters per room
+TURNS = 200
+REPEATS = 50
+SEED = 0
+
+
+def time_per_call(function, repeats: int = REPEATS):
+    """Returns the average time of a call of function in milliseconds"""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats * 1e3
+
+
+def run_case(width: int, height: int, max_rooms: int, max_monsters: int, profile_dir: Optional[Path] = None):
+    """Runs one case. With a profile_dir the Profiler times the turns and dumps them there as JSON lines"""
+    params = LevelParams(
+        max_rooms=max_rooms, map_width=width, map_height=height, max_monsters_per_room=max_monsters
+    )
+
+    start = time.perf_counter()
+    driver = HeadlessDriver(params, seed=SEED)
+    gen_ms = (time.perf_counter() - start) * 1e3
+
+    engine = driver.engine
+    engine.player.fighter.max_hp = engine.player.fighter.hp = 10 ** 9  # Keep the run going for every turn
+    game_map = engine.game_map
+    monsters = len(game_map.entities) - 1
+
+    if profile_dir:
+        engine.profiler.enabled = True
+        engine.profiler.open_dump(str(profile_dir / f"{width}x{height}_monsters{max_monsters}.jsonl"))
+    start = time.perf_counter()
+    turns = driver.run(random_policy(random.Random(SEED)), TURNS)
+    turns_per_sec = turns / (time.perf_counter() - start)
+    engine.profiler.close_dump()
+    engine.profiler.enabled = False
+
+    fov_ms = time_per_call(engine.update_fov)
+    distance_map_ms = time_per_call(lambda: DistanceMap(game_map, engine.player.x, engine.player.y))
+    nearest = min(
+        (actor for actor in game_map.actors if actor is not engine.player),
+        key=lambda actor: max(abs(actor.x - engine.player.x), abs(actor.y - engine.player.y)),
+        default=None,
+    )
+    path_ms = time_per_call(lambda: nearest.ai.get_path_to(engine.player.x, engine.player.y)) if nearest else 0.0
+
+    console = tcod.console.Console(80, 50, order="F")
+    engine.camera = Camera(80, 43)
+    render_ms = time_per_call(lambda: engine.render(console, None))
+    game_map.incremental_render = True
+    render_dirty_ms = time_per_call(lambda: engine.render(console, None))
+
+    return {
+        "map": f"{width}x{height}",
+        "max_monsters": max_monsters,
+        "monsters": monsters,
+        "turns_per_sec": round(turns_per_sec, 1),
+        "gen_ms": round(gen_ms, 3),
+        "fov_ms": round(fov_ms, 3),
+        "distance_map_ms": round(distance_map_ms, 3),
+        "path_ms": round(path_ms, 3),
+        "render_ms": round(render_ms, 3),
+        "render_dirty_ms": round(render_dirty_ms, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per case")
+    parser.add_argument(
+        "--profile-dir", default=None,
+        help="Profile the turns and write them to one JSON lines file per case in this directory",
+    )
+    args = parser.parse_args()
+    profile_dir = Path(args.profile_dir) if args.profile_dir else None
+    if profile_dir:
+        profile_dir.mkdir(parents=True, exist_ok=True)
+
+    columns = None
+    for width, height, max_rooms in MAP_SIZES:
+        for max_monsters in MONSTER_DENSITIES:
+            result = run_case(width, height, max_rooms, max_monsters, profile_dir)
+            if args.json:
+                print(json.dumps(result))
+                continue
+            if columns is None:
+                columns = list(result)
+                print(" ".join(f"{column:>15}" for column in columns))
+            print(" ".join(f"{result[column]:>15}" for column in columns))
+
+
+if __name__ == '__main__':
+    main()
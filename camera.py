@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+from typing import Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from game_map import GameMap
+
+
+class Camera:
+    """Window of the GameMap which is drawn on the console, kept centered on a target"""
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.x = 0  # Map coordinates of the top left corner of the window
+        self.y = 0
+
+    def center_on(self, x: int, y: int, game_map: GameMap):
+        """Centers the window on (x, y) without scrolling past the edges of the map"""
+        self.x = max(0, min(x - self.width // 2, game_map.width - self.width))
+        self.y = max(0, min(y - self.height // 2, game_map.height - self.height))
+
+    def get_bounds(self, game_map: GameMap) -> Tuple[int, int, int, int]:
+        """Returns the (x0, y0, x1, y1) map area shown by the camera, clipped to the map"""
+        return self.x, self.y, min(self.x + self.width, game_map.width), min(self.y + self.height, game_map.height)
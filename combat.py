@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from typing import Sequence, TYPE_CHECKING
+
+import numpy as np
+
+import color
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from entity import Actor
+    from entity_store import EntityStore
+
+
+def _resolve_hits(store: EntityStore, attackers: Sequence[Actor], targets: Sequence[Actor]):
+    """Applies the damage of the attacks to the hp column, returns the damage of every attack
+    and whether it landed and killed its target, as lists
+    """
+    attacker_slots = np.array([attacker._slot for attacker in attackers], dtype=np.intp)
+    target_slots = np.array([target._slot for target in targets], dtype=np.intp)
+    damage = np.maximum(store.power[attacker_slots] - store.defense[target_slots], 0)
+    hp = store.hp[target_slots]
+
+    if len(set(targets)) == len(targets):
+        # Every target is attacked once.
+        lands = hp > 0
+        kills = lands & (damage >= hp)
+        store.hp[target_slots] = np.where(lands, np.maximum(hp - damage, 0), hp)
+    else:
+        # Damage dealt to the target of every attack by the earlier attacks on the same target.
+        order = np.argsort(target_slots, kind="stable")
+        sorted_targets, sorted_damage = target_slots[order], damage[order]
+        group_starts = np.concatenate(([True], sorted_targets[1:] != sorted_targets[:-1]))
+        dealt = np.cumsum(sorted_damage) - sorted_damage
+        dealt -= dealt[np.flatnonzero(group_starts)][np.cumsum(group_starts) - 1]
+        damage_before = np.empty_like(dealt)
+        damage_before[order] = dealt
+
+        lands = damage_before < hp  # The target is still alive when the attack comes
+        kills = lands & (damage_before + damage >= hp)
+        np.subtract.at(store.hp, target_slots[lands], damage[lands])
+        store.hp[target_slots] = np.maximum(store.hp[target_slots], 0)
+    return damage.tolist(), lands.tolist(), kills.tolist()
+
+
+def resolve_melee(engine: Engine, attackers: Sequence[Actor], targets: Sequence[Actor]):
+    """Resolves the attacks of every attacker on the target at the same index as one batch.
+    Damage, hit points and deaths are computed on the EntityStore columns of the engine's map,
+    then the messages are logged and the killed actors turned into corpses in the order of the attacks.
+    The attacks of a batch are simultaneous: an attacker killed in the batch still strikes,
+    but attacks on a target already killed by an earlier attack miss.
+    """
+    if not attackers:
+        return
+    store = engine.game_map.store
+    if len(attackers) == 1:
+        # A single attack, as the player's, is cheaper on Python ints than through the arrays.
+        target_slot = targets[0]._slot
+        hp = int(store.hp[target_slot])
+        damage = [max(int(store.power[attackers[0]._slot]) - int(store.defense[target_slot]), 0)]
+        lands, kills = [hp > 0], [0 < hp <= damage[0]]
+        if hp > 0:
+            store.hp[target_slot] = max(hp - damage[0], 0)
+    else:
+        damage, lands, kills = _resolve_hits(store, attackers, targets)
+
+    # Names are taken before any death of the batch renames its actor into a corpse.
+    names = [(attacker.name, target.name) for attacker, target in zip(attackers, targets)]
+    for attacker, target, (attacker_name, target_name), points, landed, killed in zip(
+            attackers, targets, names, damage, lands, kills
+    ):
+        if not landed:
+            continue
+        attack_desc = f"{attacker_name.capitalize()} attacks {target_name}"
+        attack_color = color.player_atk if attacker is engine.player else color.enemy_atk
+        if points > 0:
+            engine.message_log.add_message(f"{attack_desc} for {points} points!", attack_color)
+        else:
+            engine.message_log.add_message(f"{attack_desc} but does no damage.", attack_color)
+        if killed and target.ai:
+            target.fighter.die()
@@ -1,51 +1,129 @@
 from __future__ import annotations
 
-from typing import List, Tuple, TYPE_CHECKING
+from typing import List, Optional, Tuple, TYPE_CHECKING
 
 import numpy as np
 import tcod
 
 from actions import Action, MeleeAction, MovementAction, WaitAction
 from components.base_component import BaseComponent
+from turn_scheduler import ActorState
 
 if TYPE_CHECKING:
     from entity import Actor
+    from game_map import GameMap
+
+DIRECTIONS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+
+# How far from the player the shared distance map reaches, chasing enemies are within the FOV radius.
+DISTANCE_MAP_RADIUS = 24
+# How far individual paths may stray outside the box spanned by their start and destination.
+PATH_MARGIN = 12
+
+
+def get_window(game_map: GameMap, x0: int, y0: int, x1: int, y1: int, margin: int):
+    """Returns the (x0, y0, x1, y1) area spanning both corners grown by margin, clipped to the map"""
+    return (
+        max(0, min(x0, x1) - margin),
+        max(0, min(y0, y1) - margin),
+        min(game_map.width, max(x0, x1) + margin + 1),
+        min(game_map.height, max(y0, y1) + margin + 1),
+    )
+
+
+class DistanceMap:
+    """Dijkstra map of the movement distance from every tile to the destination,
+    computed only over a window around the destination.
+    Unreachable tiles and tiles outside the window hold the maximum value of the array.
+    """
+    def __init__(self, game_map: GameMap, dest_x: int, dest_y: int, radius: int = DISTANCE_MAP_RADIUS):
+        self.x0, self.y0, x1, y1 = get_window(game_map, dest_x, dest_y, dest_x, dest_y, radius)
+        cost = game_map.get_path_cost(self.x0, self.y0, x1, y1)
+        # Counted for the phase building it, the AI class of the first enemy needing the map this turn.
+        profiler = game_map.engine.profiler
+        profiler.count("distance_maps", phase=profiler.current_phase)
+        profiler.count("path_cells", cost.size, phase=profiler.current_phase)
+        self.distance = tcod.path.maxarray(cost.shape, order="F")
+        self.distance[dest_x - self.x0, dest_y - self.y0] = 0
+        tcod.path.dijkstra2d(self.distance, cost, cardinal=2, diagonal=3, out=self.distance)
+        self.unreachable = np.iinfo(self.distance.dtype).max
+
+    def __getitem__(self, xy: Tuple[int, int]):
+        x = xy[0] - self.x0
+        y = xy[1] - self.y0
+        if 0 <= x < self.distance.shape[0] and 0 <= y < self.distance.shape[1]:
+            return self.distance[x, y]
+        return self.unreachable
 
 
 class BaseAI(Action, BaseComponent):
     """Base of the AI for the enemies"""
 
     entity: Actor = None
+    profiler_phase = "ai.BaseAI"  # Profiler phase timing the turns of this AI class
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.profiler_phase = f"ai.{cls.__name__}"
+
     def perform(self):
         raise NotImplementedError()
 
+    @property
+    def is_awake(self):
+        """True if this AI has to act even in turns where the player can't see its entity"""
+        return True
+
+    def act(self, state: ActorState) -> Optional[Action]:
+        """Decides a turn already triaged by the TurnScheduler.
+        Returns the action to resolve in the engine's batched ActionQueue, or None if the turn is over already.
+        Falls back to perform by default.
+        """
+        self.perform()
+        return None
+
     def get_path_to(self, dest_x: int, dest_y: int):
         """Compute and return a path to the target position.
         If there is no valid path then returns an empty list.
         """
-        # Copy the walkable array.
-        cost = np.array(self.entity.game_map.tiles["walkable"], dtype=np.int8)
-
-        for entity in self.entity.game_map.entities:
-            # Check that an entity blocks movement and the cost isn't zero (blocking.)
-            if entity.blocks_movement and cost[entity.x, entity.y]:
-                # Add to the cost of a blocked position.
-                # A lower number means more enemies will crowd behind each other in
-                # hallways.  A higher number means enemies will take longer paths in
-                # order to surround the player.
-                cost[entity.x, entity.y] += 10
+        # Only search the area around the start and the destination.
+        x0, y0, x1, y1 = get_window(self.entity.game_map, self.entity.x, self.entity.y, dest_x, dest_y, PATH_MARGIN)
+        cost = self.entity.game_map.get_path_cost(x0, y0, x1, y1)
+        self.engine.profiler.count("paths", phase=self.profiler_phase)
+        self.engine.profiler.count("path_cells", cost.size, phase=self.profiler_phase)
 
         # Create a graph from the cost array and pass that graph to a new pathfinder.
         graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
         pathfinder = tcod.path.Pathfinder(graph)
 
-        pathfinder.add_root((self.entity.x, self.entity.y))  # Start position.
+        pathfinder.add_root((self.entity.x - x0, self.entity.y - y0))  # Start position.
 
         # Compute the path to the destination and remove the starting point.
-        path = pathfinder.path_to((dest_x, dest_y))[1:].tolist()
+        path = pathfinder.path_to((dest_x - x0, dest_y - y0))[1:].tolist()
 
-        # Convert from List[List[int]] to List[Tuple[int, int]].
-        return [(index[0], index[1]) for index in path]
+        # Convert from List[List[int]] to List[Tuple[int, int]] in map coordinates.
+        return [(index[0] + x0, index[1] + y0) for index in path]
+
+    def get_step_towards_player(self) -> Optional[Tuple[int, int]]:
+        """Returns the (dx, dy) step down the engine's distance-to-player map.
+        If every closer neighbouring tile is blocked then returns None.
+        """
+        game_map = self.entity.game_map
+        distance = self.engine.player_distance
+        x, y = self.entity.x, self.entity.y
+
+        best_distance = distance[x, y]
+        step = None
+        for dx, dy in DIRECTIONS:
+            dest_x, dest_y = x + dx, y + dy
+            if not game_map.in_bounds(dest_x, dest_y):
+                continue
+            if distance[dest_x, dest_y] < best_distance and not game_map.get_blocking_entity_at_location(dest_x, dest_y):
+                best_distance = distance[dest_x, dest_y]
+                step = dx, dy
+
+        return step
 
 
 class HostileEnemy(BaseAI):
@@ -56,24 +134,56 @@ class HostileEnemy(BaseAI):
     if the entity is too far from the player and
     player can see the entity: move towards the player
     """
+
+    # When True, the enemy computes its own path to the player if it can't step down the shared distance map.
+    path_fallback = False
+
     def __init__(self, entity: Actor):
         super().__init__(entity)
-        self.path = []
+        self.path: List[Tuple[int, int]] = []
+        self.last_seen: Optional[Tuple[int, int]] = None  # Last known position of the player
+
+    @property
+    def is_awake(self):
+        """The enemy keeps acting out of the player's sight while it heads to where it saw the player last"""
+        return bool(self.path or self.last_seen)
 
     def perform(self):
         target = self.engine.player
-        dx = target.x - self.entity.x
-        dy = target.y - self.entity.y
-        distance = max(abs(dx), abs(dy))
+        distance = max(abs(target.x - self.entity.x), abs(target.y - self.entity.y))
+
+        if not self.engine.game_map.visible[self.entity.x, self.entity.y]:
+            state = ActorState.IDLE
+        elif distance <= 1:
+            state = ActorState.MELEE
+        else:
+            state = ActorState.CHASE
+
+        return self.act(state).perform()
+
+    def act(self, state: ActorState) -> Action:
+        target = self.engine.player
+
+        if state == ActorState.MELEE:
+            return MeleeAction(self.entity, target.x - self.entity.x, target.y - self.entity.y)
+
+        if state == ActorState.CHASE:
+            self.last_seen = target.x, target.y
+            self.path = []
 
-        if self.engine.game_map.visible[self.entity.x, self.entity.y]:
-            if distance <= 1:
-                return MeleeAction(self.entity, dx, dy).perform()
+            step = self.get_step_towards_player()
+            if step:
+                return MovementAction(self.entity, *step)
+            if self.path_fallback:
+                self.path = self.get_path_to(target.x, target.y)
 
-            self.path = self.get_path_to(target.x, target.y)
+        elif self.last_seen:
+            # The player went out of sight, head to where it was seen last.
+            self.path = self.get_path_to(*self.last_seen)
+            self.last_seen = None
 
         if self.path:
             dest_x, dest_y = self.path.pop(0)
-            return MovementAction(self.entity, dest_x - self.entity.x, dest_y - self.entity.y).perform()
+            return MovementAction(self.entity, dest_x - self.entity.x, dest_y - self.entity.y)
 
-        return WaitAction(self.entity).perform()
+        return WaitAction(self.entity)
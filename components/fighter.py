@@ -3,6 +3,7 @@ from typing import TYPE_CHECKING
 
 import color
 from components.base_component import BaseComponent
+from entity_store import StoreField
 from input_handlers import GameOverEventHandler
 from render_order import RenderOrder
 
@@ -13,25 +14,38 @@ if TYPE_CHECKING:
 class Fighter(BaseComponent):
     """
     Component holding information related to combat.
-    If an entity can fight it will have this component attached
+    If an entity can fight it will have this component attached.
+    The stats are views over the EntityStore of the owning entity.
     """
     entity: Actor
 
+    max_hp = StoreField(via_entity=True)
+    defense = StoreField(via_entity=True)  # Reduced damage
+    power = StoreField(via_entity=True)  # Attack power
+
     def __init__(self, hp: int, defense: int, power: int):
+        # Kept only until the component is attached to its entity.
+        self.base_stats = hp, defense, power
+
+    def attach(self, entity: Actor):
+        """Attaches this component to the entity and writes its stats into the entity's store"""
+        self.entity = entity
+        hp, defense, power = self.base_stats
         self.max_hp = hp
-        self._hp = hp
-        self.defense = defense  # Reduced damage
-        self.power = power  # Attack power
+        self.entity._store.hp[self.entity._slot] = hp
+        self.defense = defense
+        self.power = power
 
     @property
     def hp(self):
-        return self._hp
+        return int(self.entity._store.hp[self.entity._slot])
 
     @hp.setter
     def hp(self, value: int):
         """Sets the hp. Will never be less than 0 but never higher than max_hp"""
-        self._hp = max(0, min(value, self.max_hp))
-        if self._hp == 0 and self.entity.ai:
+        hp = max(0, min(value, self.max_hp))
+        self.entity._store.hp[self.entity._slot] = hp
+        if hp == 0 and self.entity.ai:
             self.die()
 
     def die(self):
@@ -49,5 +63,6 @@ class Fighter(BaseComponent):
         self.entity.ai = None
         self.entity.name = f"dead body of {self.entity.name}"
         self.entity.render_order = RenderOrder.CORPSE
+        self.entity.game_map.reindex_entity(self.entity)
 
         self.engine.message_log.add_message(death_message, death_message_color)
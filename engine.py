@@ -1,56 +1,145 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import Optional, TYPE_CHECKING
+
+import numpy as np
 from tcod.context import Context
 from tcod.console import Console
 from tcod.map import compute_fov
+import color
+from action_queue import ActionQueue
+from components.ai import DistanceMap
 from input_handlers import MainGameEventHandler
 from message_log import MessageLog
+from profiler import Profiler
 from render_functions import render_bar
 
 if TYPE_CHECKING:
+    from actions import Action
+    from camera import Camera
     from entity import Actor
     from game_map import GameMap
+    from replay import Recording
 
 
 class Engine:
     """Engine object is responsible for updating fov, handling turns and rendering a whole game"""
 
     game_map: GameMap = None
+    camera: Optional[Camera] = None  # Without a camera the whole map is rendered
+    recording: Optional[Recording] = None  # Records the player's actions when set
+
+    fov_radius = 8
 
     def __init__(self, player: Actor):
         self.event_handler = MainGameEventHandler(self)
         self.message_log = MessageLog()
+        self.profiler = Profiler()
+        self.action_queue = ActionQueue()
         self.player = player
+        self._player_distance: Optional[DistanceMap] = None
+
+    @property
+    def player_distance(self):
+        """Distance-to-player map shared by all enemies, computed at most once per enemy turn"""
+        if self._player_distance is None:
+            self._player_distance = DistanceMap(self.game_map, self.player.x, self.player.y)
+        return self._player_distance
+
+    def take_turn(self, action: Action):
+        """Performs the player's action, then the enemy turns, then updates the FOV"""
+        profiler = self.profiler
+        with profiler.phase("action"):
+            action.perform()
+        if self.recording is not None:
+            self.recording.record(action)
+
+        with profiler.phase("enemy_turns"):
+            self.handle_enemy_turns()
+        with profiler.phase("fov"):
+            self.update_fov()  # Update the FOV before the players next action.
+        profiler.end_turn()
 
     def handle_enemy_turns(self):
         """Handles enemy turns (placeholder for now)"""
-        for entity in set(self.game_map.actors) - {self.player}:
+        self._player_distance = None  # The player and the enemies have moved since the last turn.
+        scheduler = self.game_map.scheduler
+        profiler = self.profiler
+        with profiler.phase("triage"):
+            acting = scheduler.triage(self.player)
+        profiler.count("acting_actors", len(acting))
+        for entity, state in acting:
             if entity.ai:
-                entity.ai.perform()
+                with profiler.phase(entity.ai.profiler_phase):
+                    action = entity.ai.act(state)
+                if action:
+                    self.action_queue.submit(action)
+                scheduler.update_awake(entity)
+                self.game_map.acted.add(entity)
+        with profiler.phase("resolve"):
+            self.action_queue.resolve(self.game_map)
 
     def update_fov(self):
-        """Updates fov with the help of TCOD"""
-        self.game_map.visible[:] = compute_fov(
-            self.game_map.tiles["transparent"],
-            (self.player.x, self.player.y),
-            radius=8,
+        """Updates fov with the help of TCOD.
+        Only the (2r+1)^2 window the FOV radius can reach is computed, cleared and merged,
+        so the cost doesn't depend on the size of the map.
+        """
+        radius = self.fov_radius
+        x0, y0 = max(0, self.player.x - radius), max(0, self.player.y - radius)
+        window = np.s_[x0:self.player.x + radius + 1, y0:self.player.y + radius + 1]
+
+        if self.game_map.fov_window is not None:
+            self.game_map.visible[self.game_map.fov_window] = False
+        self.game_map.fov_window = window
+
+        self.game_map.visible[window] = compute_fov(
+            self.game_map.tiles["transparent"][window],
+            (self.player.x - x0, self.player.y - y0),
+            radius=radius,
         )
 
-        self.game_map.explored |= self.game_map.visible
+        xs, ys = np.nonzero(self.game_map.visible[window] & ~self.game_map.explored[window])
+        if len(xs):
+            self.game_map.mark_explored(xs + x0, ys + y0)
 
-    def render(self, console: Console, context: Context):
-        """Renders a game to the screen"""
-        self.game_map.render(console)
+    def render(self, console: Console, context: Optional[Context]):
+        """Renders a game to the screen. Without a context the console is only drawn, as in headless runs"""
+        with self.profiler.phase("render"):
+            if self.camera:
+                self.camera.center_on(self.player.x, self.player.y, self.game_map)
+                x0, y0, x1, y1 = self.camera.get_bounds(self.game_map)
+            else:
+                x0, y0, x1, y1 = 0, 0, self.game_map.width, self.game_map.height
+            self.game_map.render(console, self.camera)
 
-        self.message_log.render(console=console, x=21, y=45, width=40, height=5)
-        # Renders the health bar
-        render_bar(
-            console=console,
-            current_value=self.player.fighter.hp,
-            maximum_value=self.player.fighter.max_hp,
-            total_width=20,
-        )
-        context.present(console)
+            self.message_log.render(console=console, x=21, y=45, width=40, height=5)
+            # Renders the health bar
+            render_bar(
+                console=console,
+                current_value=self.player.fighter.hp,
+                maximum_value=self.player.fighter.max_hp,
+                total_width=20,
+            )
+
+        self.event_handler.on_render(console)
+        if self.event_handler.overlays_map:
+            self.game_map.dirty[x0:x1, y0:y1] = True
+        if self.profiler.show_overlay:
+            self.profiler.render(console, x=0, y=0)
+            # The overlay covers the top rows of the map, which have to be redrawn next frame.
+            self.game_map.dirty[x0:x1, y0:y0 + len(self.profiler.history)] = True
+        if context:
+            context.present(console)
 
-        console.clear()
+        if self.game_map.incremental_render:
+            # Keep the map area, GameMap.render only redraws its dirty cells.
+            console.draw_rect(
+                x=0, y=y1 - y0, width=console.width, height=console.height, ch=ord(" "),
+                fg=color.white, bg=color.black,
+            )
+            console.draw_rect(
+                x=x1 - x0, y=0, width=console.width, height=y1 - y0, ch=ord(" "),
+                fg=color.white, bg=color.black,
+            )
+        else:
+            console.clear()
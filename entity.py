@@ -1,18 +1,29 @@
 from __future__ import annotations
-import copy
 
-from typing import Tuple, Type, Optional, TYPE_CHECKING
+from typing import Iterable, List, Tuple, Type, Optional, TYPE_CHECKING
+
+import numpy as np
 
 if TYPE_CHECKING:
     from components.ai import BaseAI
-    from components.fighter import Fighter
+    from entity_store import EntityStore
     from game_map import GameMap
 
+from components.fighter import Fighter
+from entity_store import StoreField, detached_store
 from render_order import RenderOrder
 
 
 class Entity:
-    """Object representing various entities like player, enemies, items etc."""
+    """Object representing various entities like player, enemies, items etc.
+    Position, glyph and render order are views over the EntityStore of the entity's GameMap.
+    """
+    __slots__ = ("_store", "_slot", "name", "game_map")
+
+    x = StoreField()
+    y = StoreField()
+    color = StoreField(tuple)
+    blocks_movement = StoreField(bool)  # Defines if the entity blocks movement
 
     def __init__(
             self,
@@ -25,6 +36,8 @@ class Entity:
             blocks_movement: bool = False,  # Defines if the entity blocks movement
             render_order: RenderOrder = RenderOrder.ACTOR
     ):
+        self._store: EntityStore = detached_store
+        self._slot = detached_store.allocate()
         self.x = x
         self.y = y
         self.char = char
@@ -34,35 +47,81 @@ class Entity:
         self.render_order = render_order
         if game_map:
             self.game_map = game_map
-            game_map.entities.add(self)
+            game_map.add_entity(self)
 
-    def spawn(self, game_map: GameMap, x: int, y: int):
-        """Spawning entities"""
-        clone = copy.deepcopy(self)
-        clone.x = x
-        clone.y = y
-        clone.game_map = game_map
-        game_map.entities.add(clone)
-        return clone
+    @property
+    def char(self):
+        return chr(self._store.ch[self._slot])
+
+    @char.setter
+    def char(self, value: str):
+        self._store.ch[self._slot] = ord(value)
+
+    @property
+    def render_order(self):
+        return RenderOrder(self._store.render_order[self._slot])
+
+    @render_order.setter
+    def render_order(self, value: RenderOrder):
+        self._store.render_order[self._slot] = value.value
+
+    def __getstate__(self):
+        """Stores the record of the entity instead of its whole EntityStore"""
+        state = {name: getattr(self, name) for name in self._state_slots() if hasattr(self, name)}
+        state["record"] = self._store.get_record(self._slot)
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        self._store = detached_store
+        self._slot = detached_store.allocate()
+        detached_store.set_record(self._slot, state.pop("record"))
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def _state_slots(cls):
+        for klass in cls.__mro__:
+            for name in getattr(klass, "__slots__", ()):
+                if name not in ("_store", "_slot"):
+                    yield name
+
+    def attach_store(self, store: EntityStore):
+        """Moves the record of this entity to the given store"""
+        if store is not self._store:
+            self._slot = self._store.transfer(self._slot, store)
+            self._store = store
 
     def place(self, x: int, y: int, game_map: Optional[GameMap] = None):
         """Place this entity at a new location, handles moving across GameMaps"""
-        self.x = x
-        self.y = y
-
-        if game_map:
+        if game_map and self not in game_map.entities:
             if hasattr(self, "game_map"):
-                self.game_map.entities.remove(self)
+                self.game_map.remove_entity(self)
+            self.x = x
+            self.y = y
             self.game_map = game_map
-            game_map.entities.add(self)
+            game_map.add_entity(self)
+        else:
+            if game_map:
+                # The map already holds this entity, moving it there keeps its store slot and scheduling order.
+                self.game_map = game_map
+            old_x, old_y = self.x, self.y
+            self.x = x
+            self.y = y
+            if hasattr(self, "game_map"):
+                self.game_map.relocate_entity(self, old_x, old_y)
 
     def move(self, dx: int, dy: int):
         """Moving the entity"""
+        old_x, old_y = self.x, self.y
         self.x += dx
         self.y += dy
+        self.game_map.relocate_entity(self, old_x, old_y)
 
 
 class Actor(Entity):
+    __slots__ = ("ai", "fighter")
+
     def __init__(
             self,
             *,
@@ -87,9 +146,92 @@ class Actor(Entity):
         self.ai = ai_cls(self)
 
         self.fighter = fighter
-        self.fighter.entity = self
+        self.fighter.attach(self)
 
     @property
     def is_alive(self):
         """Returns True as long as this actor can perform actions"""
         return bool(self.ai)
+
+    @classmethod
+    def bind(
+            cls, game_map: GameMap, slot: int, name: str, ai_cls: Optional[Type[BaseAI]], fighter: Fighter
+    ) -> Actor:
+        """Creates an Actor over a row of the game map's store and adds it to the map.
+        Used by the bulk constructors, which have already written the store columns themselves.
+        """
+        actor = cls.__new__(cls)
+        actor._store = game_map.store
+        actor._slot = slot
+        actor.name = name
+        actor.ai = ai_cls(actor) if ai_cls else None
+        actor.fighter = fighter
+        fighter.entity = actor  # The stats are already in the store
+        actor.game_map = game_map
+        game_map.add_entity(actor)
+        return actor
+
+
+class ActorPrototype:
+    """
+    Template of an Actor which records only its constructor parameters.
+    Spawning builds a new Actor with a fresh AI and Fighter instead of deep copying a prototype.
+    """
+    def __init__(
+            self,
+            *,
+            char: str = "?",
+            color: Tuple[int, int, int] = (255, 255, 255),
+            name: str = "<Unnamed>",
+            ai_cls: Type[BaseAI],
+            hp: int,
+            defense: int,
+            power: int
+    ):
+        self.char = char
+        self.color = color
+        self.name = name
+        self.ai_cls = ai_cls
+        self.hp = hp
+        self.defense = defense
+        self.power = power
+
+    def build(self, x: int = 0, y: int = 0):
+        """Returns a new Actor which is not placed on any GameMap"""
+        return Actor(
+            x=x,
+            y=y,
+            char=self.char,
+            color=self.color,
+            name=self.name,
+            ai_cls=self.ai_cls,
+            fighter=Fighter(hp=self.hp, defense=self.defense, power=self.power),
+        )
+
+    def spawn(self, game_map: GameMap, x: int, y: int):
+        """Spawns a new Actor at the location"""
+        return self.spawn_many(game_map, [(x, y)])[0]
+
+    def spawn_many(self, game_map: GameMap, positions: Iterable[Tuple[int, int]]) -> List[Actor]:
+        """Spawns a new Actor at each of the positions.
+        The store columns are written in bulk, only the AI and Fighter are created per actor.
+        """
+        xy = np.array(list(positions), dtype=np.int32).reshape(-1, 2)
+        store = game_map.store
+        slots = store.allocate_many(len(xy))
+
+        store.x[slots] = xy[:, 0]
+        store.y[slots] = xy[:, 1]
+        store.ch[slots] = ord(self.char)
+        store.color[slots] = self.color
+        store.render_order[slots] = RenderOrder.ACTOR.value
+        store.blocks_movement[slots] = True
+        store.hp[slots] = self.hp
+        store.max_hp[slots] = self.hp
+        store.defense[slots] = self.defense
+        store.power[slots] = self.power
+
+        return [
+            Actor.bind(game_map, slot, self.name, self.ai_cls, Fighter(hp=self.hp, defense=self.defense, power=self.power))
+            for slot in slots.tolist()
+        ]
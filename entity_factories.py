@@ -1,28 +1,39 @@
 from components.ai import HostileEnemy
-from components.fighter import Fighter
-from entity import Actor
+from entity import ActorPrototype
 
 """Stores the properties of the entities"""
 
-player = Actor(
+player = ActorPrototype(
     char="@",
     color=(255, 255, 255),
     name="Player",
     ai_cls=HostileEnemy,
-    fighter=Fighter(hp=30, defense=2, power=5)
+    hp=30,
+    defense=2,
+    power=5,
 )
 
-orc = Actor(
+orc = ActorPrototype(
     char="o",
     color=(63, 127, 63),
     name="Orc",
     ai_cls=HostileEnemy,
-    fighter=Fighter(hp=10, defense=0, power=3)
+    hp=10,
+    defense=0,
+    power=3,
 )
-troll = Actor(
+troll = ActorPrototype(
     char="T",
     color=(0, 127, 0),
     name="Troll",
     ai_cls=HostileEnemy,
-    fighter=Fighter(hp=16, defense=1, power=4)
+    hp=16,
+    defense=1,
+    power=4,
 )
+
+# The prototypes placed by procgen, by name. Saved levels refer to them with these names.
+monsters = {
+    "orc": orc,
+    "troll": troll,
+}
@@ -0,0 +1,117 @@
+"""Struct-of-arrays storage of the entity data which is hot in combat, rendering and AI"""
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+# Name, dtype and per-row shape of every array of an EntityStore.
+FIELDS = (
+    ("x", np.int32, ()),
+    ("y", np.int32, ()),
+    ("ch", np.int32, ()),  # Unicode codepoint of the glyph
+    ("color", np.uint8, (3,)),
+    ("render_order", np.uint8, ()),
+    ("blocks_movement", bool, ()),
+    ("hp", np.int32, ()),
+    ("max_hp", np.int32, ()),
+    ("defense", np.int32, ()),
+    ("power", np.int32, ()),
+)
+
+
+class EntityStore:
+    """
+    Columns of entity data, one NumPy array per field and one row (slot) per entity.
+    Each GameMap owns a store holding the entities placed on it, so whole-map
+    passes can work on the arrays directly. Unplaced entities live in detached_store.
+    """
+    def __init__(self, capacity: int = 64):
+        self.capacity = capacity
+        self.size = 0  # Slots past size have never been used
+        self._free: List[int] = []
+        self.used = np.zeros(capacity, dtype=bool)
+        for name, dtype, shape in FIELDS:
+            setattr(self, name, np.zeros((capacity, *shape), dtype=dtype))
+
+    def __len__(self):
+        return self.size - len(self._free)
+
+    def _grow(self):
+        self.capacity *= 2
+        self.used = np.resize(self.used, self.capacity)
+        self.used[self.size:] = False
+        for name, dtype, shape in FIELDS:
+            setattr(self, name, np.resize(getattr(self, name), (self.capacity, *shape)))
+
+    def allocate(self):
+        """Returns a free slot, growing the arrays if needed"""
+        if self._free:
+            slot = self._free.pop()
+        else:
+            if self.size == self.capacity:
+                self._grow()
+            slot = self.size
+            self.size += 1
+        self.used[slot] = True
+        return slot
+
+    def allocate_many(self, count: int) -> np.ndarray:
+        """Returns an array of count free slots, growing the arrays at most once"""
+        reused = [self._free.pop() for _ in range(min(count, len(self._free)))]
+        new = count - len(reused)
+        while self.size + new > self.capacity:
+            self._grow()
+        slots = np.concatenate([np.array(reused, dtype=np.intp), np.arange(self.size, self.size + new)])
+        self.size += new
+        self.used[slots] = True
+        return slots
+
+    def release(self, slot: int):
+        """Frees the slot so it can be reused by another entity"""
+        self.used[slot] = False
+        self._free.append(slot)
+
+    def get_record(self, slot: int) -> Dict[str, Any]:
+        """Returns the values of the slot as a dict of Python objects"""
+        return {name: getattr(self, name)[slot].tolist() for name, _, _ in FIELDS}
+
+    def set_record(self, slot: int, record: Dict[str, Any]):
+        for name, value in record.items():
+            getattr(self, name)[slot] = value
+
+    def transfer(self, slot: int, other: EntityStore):
+        """Moves the record in the slot to the other store and returns its new slot there"""
+        new_slot = other.allocate()
+        for name, _, _ in FIELDS:
+            getattr(other, name)[new_slot] = getattr(self, name)[slot]
+        self.release(slot)
+        return new_slot
+
+
+class StoreField:
+    """
+    Descriptor exposing one array of the EntityStore as an attribute of an entity.
+    With via_entity set it is used on a component and reads the store of component.entity.
+    """
+    def __init__(self, convert: Callable[[Any], Any] = int, *, via_entity: bool = False):
+        self.convert = convert
+        self.via_entity = via_entity
+        self.name = ""
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        entity = instance.entity if self.via_entity else instance
+        return self.convert(getattr(entity._store, self.name)[entity._slot])
+
+    def __set__(self, instance, value):
+        entity = instance.entity if self.via_entity else instance
+        getattr(entity._store, self.name)[entity._slot] = value
+
+
+# Holds the entities which are not placed on any GameMap, such as the prototypes in entity_factories.
+detached_store = EntityStore()
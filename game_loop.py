@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import time
+from collections import deque
+from typing import Deque, Iterator, TYPE_CHECKING
+
+import tcod.event
+from tcod.console import Console
+from tcod.context import Context
+
+if TYPE_CHECKING:
+    from engine import Engine
+
+
+class GameLoop:
+    """Non-blocking main loop running at a fixed timestep.
+    Each tick polls the pending events and renders only if something changed, then the time left
+    until the next tick is spent on background jobs before sleeping.
+    """
+    def __init__(self, engine: Engine, context: Context, console: Console, tick_rate: int = 60):
+        self.engine = engine
+        self.context = context
+        self.console = console
+        self.tick_period = 1 / tick_rate
+        # Background jobs are iterators, each step of a job is a slice of its work.
+        self.jobs: Deque[Iterator] = deque()
+        self.redraw = True
+
+    def add_job(self, job: Iterator):
+        """Schedules a job to run step by step in the idle time of the ticks"""
+        self.jobs.append(job)
+
+    def run_jobs(self, deadline: float):
+        """Runs steps of the jobs in turn until the deadline or until there are none left"""
+        while self.jobs and time.perf_counter() < deadline:
+            job = self.jobs[0]
+            try:
+                next(job)
+            except StopIteration:
+                self.jobs.popleft()
+            else:
+                self.jobs.rotate(-1)
+
+    def tick(self):
+        """Handles the pending events and renders the game if any arrived since the last frame"""
+        events = list(tcod.event.get())
+        if events:
+            self.engine.event_handler.handle_events(events)
+            self.redraw = True  # Window events need a redraw as well, so any event triggers one.
+        if self.redraw:
+            self.engine.render(self.console, self.context)
+            self.redraw = False
+
+    def run(self):
+        next_tick = time.perf_counter()
+        while True:
+            self.tick()
+            next_tick = max(next_tick + self.tick_period, time.perf_counter())  # Don't catch up missed ticks
+            self.run_jobs(next_tick)
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
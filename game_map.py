@@ -1,45 +1,264 @@
 from __future__ import annotations
-from typing import Iterable, TYPE_CHECKING
+import bisect
+import mmap
+from typing import Dict, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING
 import numpy as np
 from tcod.console import Console
 import tile_types
 from entity import Actor
+from entity_store import EntityStore, detached_store
+from turn_scheduler import TurnScheduler
 
 if TYPE_CHECKING:
+    from camera import Camera
     from engine import Engine
     from entity import Entity
+    from snapshot import Timeline
+    from tile_storage import TileArray
+
+# Extra path cost of a tile occupied by a blocking entity.
+# A lower number means more enemies will crowd behind each other in
+# hallways.  A higher number means enemies will take longer paths in
+# order to surround the player.
+CROWD_COST = 10
+
+# Size of the square buckets of the spatial index used for area queries.
+BUCKET_SIZE = 16
+
+
+def _lazy_zeros(width: int, height: int, dtype) -> np.ndarray:
+    """Returns a zero filled (width, height) array whose memory is only allocated page by page as it is written.
+    np.zeros asks for huge pages on large arrays, so a single write would take 2 MB instead of 4 kB.
+    """
+    buffer = mmap.mmap(-1, max(1, width * height * np.dtype(dtype).itemsize))
+    if hasattr(mmap, "MADV_NOHUGEPAGE"):
+        buffer.madvise(mmap.MADV_NOHUGEPAGE)
+    return np.frombuffer(buffer, dtype=dtype, count=width * height).reshape((width, height), order="F")
 
 
 class GameMap:
     """Object representing and generating GameMaps"""
+
+    seed: Optional[int] = None  # Seed of the procgen run which generated this map
+
     def __init__(
-            self, engine: Engine, width: int, height: int, entities: Iterable[Entity] = ()
+            self,
+            engine: Engine,
+            width: int,
+            height: int,
+            entities: Iterable[Entity] = (),
+            incremental_render: bool = False,
+            tiles: Optional[TileArray] = None,
     ):
         self.engine = engine
         self.width, self.height = width, height
-        self.tiles = np.full((width, height), fill_value=tile_types.wall, order="F")
-        self.entities = set(entities)
-        self.visible = np.full((width, height), fill_value=False, order="F")
-        self.explored = np.full((width, height), fill_value=False, order="F")
+        if tiles is None:
+            tiles = np.full((width, height), fill_value=tile_types.wall, order="F")
+        self.tiles = tiles
+        # The per-cell arrays are allocated page by page as they are written, so the parts of huge maps
+        # which are never visited take no memory.
+        self.visible = _lazy_zeros(width, height, bool)
+        self.explored = _lazy_zeros(width, height, bool)
+        # Area written by the last FOV update, nothing outside of it is visible. None while nothing is.
+        self.fov_window: Optional[Tuple[slice, slice]] = None
+        # Cells explored by every mark_explored call, up to explored_mark.
+        self.explored_log: List[Tuple[np.ndarray, np.ndarray]] = []
+        self.explored_mark = 0
+
+        # Path cost of the tiles alone, built lazily and dropped by invalidate_tiles.
+        self._base_cost: Optional[np.ndarray] = None
+        # Overlay holding 1 where a blocking entity stands, kept in sync with the blockers index.
+        self.occupancy = _lazy_zeros(width, height, np.int8)
+        # Reused output buffer of get_path_cost.
+        self._path_cost = _lazy_zeros(width, height, np.int8)
+
+        # With incremental_render only the dirty cells are recomposited each frame,
+        # the rest of the map is kept on the console from the previous frames.
+        self.incremental_render = incremental_render
+        self.dirty = _lazy_zeros(width, height, bool)
+        self._last_visible = _lazy_zeros(width, height, bool)
+        self._last_explored = _lazy_zeros(width, height, bool)
+        self._render_console: Optional[Console] = None
+        self._render_bounds: Tuple[int, int, int, int] = (0, 0, 0, 0)
+
+        # (render order, store slot) of every entity, kept sorted as entities are added or change.
+        self._render_keys: List[Tuple[int, int]] = []
+        self._render_key: Dict[Entity, Tuple[int, int]] = {}
+        self._render_slots: Optional[np.ndarray] = None
+
+        # Columns of position, glyph and combat stats of the entities on this map.
+        self.store = EntityStore()
+        self.scheduler = TurnScheduler(self)
+        self.entities = set()
+        # Spatial index of the entities blocking movement, keyed by their (x, y) cell.
+        self.blockers: Dict[Tuple[int, int], Entity] = {}
+        # Spatial index of all entities, keyed by the BUCKET_SIZE square bucket they stand in.
+        self.buckets: Dict[Tuple[int, int], Set[Entity]] = {}
+        # Entities whose AI acted since the last snapshot was taken or restored, the others kept their AI state.
+        self.acted: Set[Entity] = set()
+        self.snapshot_timeline: Optional[Timeline] = None
+        for entity in entities:
+            self.add_entity(entity)
 
     @property
     def actors(self):
         """Returns living actors"""
         yield from (entity for entity in self.entities if isinstance(entity, Actor) and entity.is_alive)
 
-    def get_blocking_entity_at_location(self, location_x: int, location_y: int):
-        """Returns entity blocking move at the players direction"""
-        for entity in self.entities:
-            if entity.blocks_movement and entity.x == location_x and entity.y == location_y:
-                return entity
+    @property
+    def base_cost(self):
+        """Path cost of the tiles without entities: 1 for walkable tiles and 0 for blocked ones"""
+        if self._base_cost is None:
+            self._base_cost = np.array(self.tiles["walkable"], dtype=np.int8, order="F")
+        return self._base_cost
 
-        return None
+    def invalidate_tiles(self):
+        """Must be called after writing to self.tiles so the cached path costs are rebuilt"""
+        self._base_cost = None
+        self._render_console = None  # Forces a full redraw of the next incremental frame
+
+    def _get_base_cost(self, window: Tuple[slice, slice]):
+        if isinstance(self.tiles, np.ndarray):
+            return self.base_cost[window]
+        # Palette storages look the mask up themselves, chunked ones may not even fit in memory as a whole.
+        return self.tiles["walkable"][window]
+
+    def get_path_cost(self, x0: int = 0, y0: int = 0, x1: Optional[int] = None, y1: Optional[int] = None):
+        """Returns the path cost of the [x0:x1, y0:y1] window of the map,
+        with the crowd cost added on tiles occupied by blocking entities.
+        The array is reused by the next call, so it must not be kept across turns.
+        """
+        window = np.s_[x0:x1, y0:y1]
+        cost = self._path_cost[window]
+        np.multiply(self.occupancy[window], CROWD_COST, out=cost)
+        cost += 1
+        cost *= self._get_base_cost(window)  # Tiles which can't be walked on stay at 0 (blocking.)
+        return cost
+
+    def add_entity(self, entity: Entity):
+        """Adds the entity to this map and indexes it at its current location"""
+        entity.attach_store(self.store)
+        self.entities.add(entity)
+        self._index(entity)
+        self.buckets.setdefault(self._bucket(entity.x, entity.y), set()).add(entity)
+        self._update_render_key(entity)
+        self.dirty[entity.x, entity.y] = True
+        if isinstance(entity, Actor) and entity.is_alive:
+            self.scheduler.add(entity)
+
+    def remove_entity(self, entity: Entity):
+        """Removes the entity from this map and from the spatial index"""
+        if entity not in self.entities:
+            return
+        self.entities.discard(entity)
+        self._unindex(entity, entity.x, entity.y)
+        self.buckets[self._bucket(entity.x, entity.y)].discard(entity)
+        self._remove_render_key(entity)
+        self.dirty[entity.x, entity.y] = True
+        self.scheduler.remove(entity)
+        entity.attach_store(detached_store)
 
-    def get_actor_at_location(self, x: int, y: int):
+    def relocate_entity(self, entity: Entity, old_x: int, old_y: int):
+        """Updates the spatial index after the entity has moved away from (old_x, old_y)"""
+        self._unindex(entity, old_x, old_y)
+        self._index(entity)
+        old_bucket, bucket = self._bucket(old_x, old_y), self._bucket(entity.x, entity.y)
+        if old_bucket != bucket:
+            self.buckets[old_bucket].discard(entity)
+            self.buckets.setdefault(bucket, set()).add(entity)
+        self.dirty[old_x, old_y] = True
+        self.dirty[entity.x, entity.y] = True
+
+    def reindex_entity(self, entity: Entity):
+        """Updates the spatial index and the render list after the entity has changed its
+        blocks_movement flag, glyph or render order, or has died
+        """
+        self.relocate_entity(entity, entity.x, entity.y)
+        self._update_render_key(entity)
+        if not (isinstance(entity, Actor) and entity.is_alive):
+            self.scheduler.remove(entity)
+
+    def reindex_entities(self, entities: List[Entity], old_positions: List[Tuple[int, int]]):
+        """Updates the spatial index and the render list after the store records of the entities were
+        overwritten, e.g. by restoring a snapshot. old_positions holds where each entity stood before.
+        """
+        # Unindex all the entities before indexing any, so entities swapping cells don't unindex each other.
+        for entity, (x, y) in zip(entities, old_positions):
+            self._unindex(entity, x, y)
+            self.buckets[self._bucket(x, y)].discard(entity)
+            self.dirty[x, y] = True
+        for entity in entities:
+            self._index(entity)
+            self.buckets.setdefault(self._bucket(entity.x, entity.y), set()).add(entity)
+            self._update_render_key(entity)
+            self.dirty[entity.x, entity.y] = True
+
+    def mark_explored(self, xs: np.ndarray, ys: np.ndarray):
+        """Marks the cells explored and logs them, so snapshots can roll the explored mask back"""
+        self.explored[xs, ys] = True
+        if self.explored_mark < len(self.explored_log):
+            # Turns are being played again after a rollback, the entry is overwritten in place
+            # so the later entries stay usable when the same turns are replayed.
+            self.explored_log[self.explored_mark] = xs, ys
+        else:
+            self.explored_log.append((xs, ys))
+        self.explored_mark += 1
+
+    @staticmethod
+    def _bucket(x: int, y: int):
+        return x // BUCKET_SIZE, y // BUCKET_SIZE
+
+    def get_entities_in_rect(self, x0: int, y0: int, x1: int, y1: int) -> List[Entity]:
+        """Returns the entities standing in the [x0:x1, y0:y1] area, using the bucket index"""
+        entities = []
+        for bucket_x in range(x0 // BUCKET_SIZE, (x1 - 1) // BUCKET_SIZE + 1):
+            for bucket_y in range(y0 // BUCKET_SIZE, (y1 - 1) // BUCKET_SIZE + 1):
+                for entity in self.buckets.get((bucket_x, bucket_y), ()):
+                    if x0 <= entity.x < x1 and y0 <= entity.y < y1:
+                        entities.append(entity)
+        return entities
+
+    def _index(self, entity: Entity):
+        if entity.blocks_movement:
+            self.blockers[entity.x, entity.y] = entity
+            self.occupancy[entity.x, entity.y] = 1
+
+    def _unindex(self, entity: Entity, x: int, y: int):
+        if self.blockers.get((x, y)) is entity:
+            del self.blockers[x, y]
+            self.occupancy[x, y] = 0
+
+    def _update_render_key(self, entity: Entity):
+        key = entity.render_order.value, entity._slot
+        if self._render_key.get(entity) != key:
+            self._remove_render_key(entity)
+            bisect.insort(self._render_keys, key)
+            self._render_key[entity] = key
+            self._render_slots = None
+
+    def _remove_render_key(self, entity: Entity):
+        key = self._render_key.pop(entity, None)
+        if key is not None:
+            del self._render_keys[bisect.bisect_left(self._render_keys, key)]
+            self._render_slots = None
+
+    @property
+    def render_slots(self):
+        """Store slots of the entities in ascending render order"""
+        if self._render_slots is None:
+            self._render_slots = np.array([slot for _, slot in self._render_keys], dtype=np.intp)
+        return self._render_slots
+
+    def get_blocking_entity_at_location(self, location_x: int, location_y: int) -> Optional[Entity]:
+        """Returns entity blocking move at the players direction"""
+        return self.blockers.get((location_x, location_y))
+
+    def get_actor_at_location(self, x: int, y: int) -> Optional[Actor]:
         """Returns actor at the location"""
-        for actor in self.actors:
-            if actor.x == x and actor.y == y:
-                return actor
+        # Living actors always block movement, so they can be found in the blockers index.
+        entity = self.blockers.get((x, y))
+        if isinstance(entity, Actor) and entity.is_alive:
+            return entity
 
         return None
 
@@ -47,17 +266,63 @@ class GameMap:
         """Checks if the position is in the bounds of GameMap"""
         return 0 <= x < self.width and 0 <= y < self.height
 
-    def render(self, console: Console):
-        """Renders GameMap to the Console"""
+    def render(self, console: Console, camera: Optional[Camera] = None):
+        """Renders GameMap to the Console, only the area seen by the camera if there is one"""
+        x0, y0, x1, y1 = camera.get_bounds(self) if camera else (0, 0, self.width, self.height)
+        if self.incremental_render:
+            return self.render_dirty(console, x0, y0, x1, y1)
 
-        console.rgb[0:self.width, 0:self.height] = np.select(
-            condlist=[self.visible, self.explored],
-            choicelist=[self.tiles["light"], self.tiles["dark"]],
+        window = np.s_[x0:x1, y0:y1]
+        console.rgb[0:x1 - x0, 0:y1 - y0] = np.select(
+            condlist=[self.visible[window], self.explored[window]],
+            choicelist=[self.tiles["light"][window], self.tiles["dark"][window]],
             default=tile_types.SHROUD,
         )
         """Renders entities if they are visible"""
-        entities_sorted_for_rendering = sorted(self.entities, key=lambda x: x.render_order.value)
-        for entity in entities_sorted_for_rendering:
+        self._render_entities(console, self.visible[window], x0, y0, x1, y1)
+
+    def render_dirty(self, console: Console, x0: int, y0: int, x1: int, y1: int):
+        """Recomposites only the cells of the [x0:x1, y0:y1] area which changed since the last frame
+        drawn on this console: cells whose visible or explored state changed and cells entities moved
+        from or to. The whole area is redrawn when the camera has moved.
+        """
+        window = np.s_[x0:x1, y0:y1]
+        if console is not self._render_console or (x0, y0, x1, y1) != self._render_bounds:
+            self._render_console = console
+            self._render_bounds = x0, y0, x1, y1
+            self.dirty[window] = True
+
+        visible = self.visible[window]
+        explored = self.explored[window]
+        changed = self.dirty[window] | (visible != self._last_visible[window]) | (explored != self._last_explored[window])
+        xs, ys = np.nonzero(changed)
+        if len(xs):
+            map_xs, map_ys = xs + x0, ys + y0
+            console.rgb[xs, ys] = np.select(
+                condlist=[visible[xs, ys], explored[xs, ys]],
+                choicelist=[self.tiles["light"][map_xs, map_ys], self.tiles["dark"][map_xs, map_ys]],
+                default=tile_types.SHROUD,
+            )
+            self._render_entities(console, changed & visible, x0, y0, x1, y1)
+
+        self._last_visible[window] = visible
+        self._last_explored[window] = explored
+        self.dirty[window] = False
 
-            if self.visible[entity.x, entity.y]:
-                console.print(x=entity.x, y=entity.y, string=entity.char, fg=entity.color)
+    def _render_entities(self, console: Console, mask: np.ndarray, x0: int, y0: int, x1: int, y1: int):
+        """Draws the entities standing on the cells of the [x0:x1, y0:y1] area selected by mask,
+        which is indexed relative to (x0, y0)
+        """
+        store = self.store
+        if (x0, y0, x1, y1) == (0, 0, self.width, self.height):
+            slots = self.render_slots
+        else:
+            # Cull the entities with the spatial index and sort the few left by render order.
+            slots = np.array([entity._slot for entity in self.get_entities_in_rect(x0, y0, x1, y1)], dtype=np.intp)
+            slots = slots[np.lexsort((slots, store.render_order[slots]))]
+        xs, ys = store.x[slots] - x0, store.y[slots] - y0
+        drawn = mask[xs, ys]
+        # Later writes win, so the entities are drawn in ascending render order.
+        slots, xs, ys = slots[drawn], xs[drawn], ys[drawn]
+        console.rgb["ch"][xs, ys] = store.ch[slots]
+        console.rgb["fg"][xs, ys] = store.color[slots]
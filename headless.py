@@ -0,0 +1,82 @@
+"""Runs the game without a window, feeding scripted or random player actions into the Engine"""
+from __future__ import annotations
+
+import random
+from typing import Callable, Iterable, Optional, Tuple
+
+from tcod.console import Console
+
+import entity_factories
+from actions import Action, BumpAction, WaitAction
+from camera import Camera
+from engine import Engine
+from level_cache import LevelParams
+from procgen import generate_dungeon
+
+DIRECTIONS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+# A policy returns the next action of the player of the engine.
+Policy = Callable[[Engine], Action]
+
+
+def random_policy(rng: random.Random, wait_chance: float = 0.1) -> Policy:
+    """Returns a policy bumping into random directions, sometimes waiting instead"""
+    def policy(engine: Engine):
+        if rng.random() < wait_chance:
+            return WaitAction(engine.player)
+        return BumpAction(engine.player, *rng.choice(DIRECTIONS))
+    return policy
+
+
+def scripted_policy(moves: Iterable[Optional[Tuple[int, int]]]) -> Policy:
+    """Returns a policy playing the moves in order: (dx, dy) bumps, None waits"""
+    moves = iter(moves)
+
+    def policy(engine: Engine):
+        move = next(moves)
+        if move is None:
+            return WaitAction(engine.player)
+        return BumpAction(engine.player, *move)
+    return policy
+
+
+class HeadlessDriver:
+    """Drives an Engine turn by turn without a window or an event loop"""
+    def __init__(
+            self,
+            params: LevelParams = LevelParams(),
+            seed: Optional[int] = None,
+            render: bool = False,
+            viewport: Tuple[int, int] = (80, 43),
+    ):
+        self.engine = Engine(entity_factories.player.build())
+        self.engine.game_map = generate_dungeon(*params, self.engine, seed=seed)
+        self.engine.update_fov()
+        self.turn = 0
+
+        # Rendering is optional, it only draws to an off-screen console.
+        self.console: Optional[Console] = None
+        if render:
+            self.engine.camera = Camera(*viewport)
+            self.console = Console(viewport[0], viewport[1] + 7, order="F")
+
+    @property
+    def is_over(self):
+        """True once the player has died"""
+        return not self.engine.player.is_alive
+
+    def step(self, action: Action):
+        """Plays one turn with the player's action"""
+        self.engine.take_turn(action)
+        self.turn += 1
+        if self.console:
+            self.engine.render(self.console, None)
+
+    def run(self, policy: Policy, turns: int):
+        """Plays up to turns turns with the actions of the policy, stops early if the player dies.
+        Returns the number of turns played.
+        """
+        start = self.turn
+        while self.turn - start < turns and not self.is_over:
+            self.step(policy(self.engine))
+        return self.turn - start
@@ -1,8 +1,11 @@
 from __future__ import annotations
-from typing import Optional, TYPE_CHECKING
+from typing import Iterable, Optional, TYPE_CHECKING
 
+import numpy as np
+import tcod
 import tcod.event
 
+import color
 from actions import Action, BumpAction, EscapeAction, WaitAction
 
 if TYPE_CHECKING:
@@ -46,10 +49,17 @@ WAIT_KEYS = {
 
 
 class EventHandler(tcod.event.EventDispatch[Action]):
+    # True for handlers drawing over the map, whose cells then have to be redrawn every frame.
+    overlays_map = False
+
     def __init__(self, engine: Engine):
         self.engine = engine
 
-    def handle_events(self):
+    def on_render(self, console: tcod.Console):
+        """Draws what this handler shows on top of the game"""
+
+    def handle_events(self, events: Optional[Iterable[tcod.event.Event]] = None):
+        """Handles the given events, or waits for the next ones if there are none given"""
         raise NotImplementedError()
 
     def ev_quit(self, event: tcod.event.Quit):
@@ -57,17 +67,14 @@ class EventHandler(tcod.event.EventDispatch[Action]):
 
 
 class MainGameEventHandler(EventHandler):
-    def handle_events(self):
-        for event in tcod.event.wait():
+    def handle_events(self, events: Optional[Iterable[tcod.event.Event]] = None):
+        for event in tcod.event.wait() if events is None else events:
             action = self.dispatch(event)
 
             if action is None:
                 continue
 
-            action.perform()
-
-            self.engine.handle_enemy_turns()
-            self.engine.update_fov()  # Update the FOV before the players next action.
+            self.engine.take_turn(action)
 
     def ev_quit(self, event: tcod.event.Quit):
         raise SystemExit()
@@ -88,13 +95,21 @@ class MainGameEventHandler(EventHandler):
         elif key == tcod.event.K_ESCAPE:
             action = EscapeAction(player)
 
+        elif key == tcod.event.KeySym.F3:
+            # Toggles the profiler together with its overlay.
+            profiler = self.engine.profiler
+            profiler.enabled = profiler.show_overlay = not profiler.enabled
+
+        elif key == tcod.event.KeySym.v:
+            self.engine.event_handler = HistoryViewer(self.engine)
+
         # No valid key was pressed
         return action
 
 
 class GameOverEventHandler(EventHandler):
-    def handle_events(self):
-        for event in tcod.event.wait():
+    def handle_events(self, events: Optional[Iterable[tcod.event.Event]] = None):
+        for event in tcod.event.wait() if events is None else events:
             action = self.dispatch(event)
 
             if action is None:
@@ -111,4 +126,78 @@ class GameOverEventHandler(EventHandler):
             action = EscapeAction(self.engine.player)
 
         # No valid key was pressed
-        return action
\ No newline at end of file
+        return action
+
+CURSOR_Y_KEYS = {
+    tcod.event.KeySym.UP: -1,
+    tcod.event.KeySym.DOWN: 1,
+    tcod.event.KeySym.k: -1,
+    tcod.event.KeySym.j: 1,
+}
+
+
+class HistoryViewer(EventHandler):
+    """Shows the whole message history in a scrollable window, the messages spilled out of the log included.
+    The line offsets of the messages are computed once when the window opens, after that
+    every frame only wraps and draws the lines on the screen, however long the history is.
+    """
+    overlays_map = True
+
+    def __init__(self, engine: Engine):
+        super().__init__(engine)
+        self.message_log = engine.message_log
+        self.offsets: Optional[np.ndarray] = None
+        self.width = 0
+        self.page_height = 1
+        self.top: Optional[int] = None  # First line shown, None until the bottom of the log is known
+
+    @property
+    def line_count(self):
+        return int(self.offsets[-1])
+
+    def handle_events(self, events: Optional[Iterable[tcod.event.Event]] = None):
+        for event in tcod.event.wait() if events is None else events:
+            self.dispatch(event)
+
+    def on_render(self, console: tcod.Console):
+        width, height = console.width - 6, console.height - 6
+        if width != self.width:
+            self.width = width
+            self.offsets = self.message_log.line_offsets(width - 2)
+        self.page_height = height - 2
+        if self.top is None:
+            self.top = max(0, self.line_count - self.page_height)
+
+        console.draw_frame(3, 3, width, height, fg=color.white, bg=color.black)
+        console.print(3 + width // 2, 3, "┤Message history├", alignment=tcod.libtcodpy.CENTER)
+
+        # Find the message holding the first line shown, then draw the lines up to the bottom of the page.
+        index = int(np.searchsorted(self.offsets, self.top, side="right")) - 1
+        skip = self.top - int(self.offsets[max(index, 0)])
+        y, last_y = 4, 4 + self.page_height
+        while 0 <= index < len(self.message_log) and y < last_y:
+            message = self.message_log.get_message(index)
+            for line in message.wrap(width - 2)[skip:skip + last_y - y]:
+                console.print(x=4, y=y, string=line, fg=message.fg)
+                y += 1
+            index += 1
+            skip = 0
+
+    def ev_keydown(self, event: tcod.event.KeyDown):
+        key = event.sym
+        bottom = max(0, self.line_count - self.page_height)
+
+        if key in CURSOR_Y_KEYS:
+            self.top = min(max(self.top + CURSOR_Y_KEYS[key], 0), bottom)
+        elif key == tcod.event.KeySym.PAGEUP:
+            self.top = max(self.top - self.page_height, 0)
+        elif key == tcod.event.KeySym.PAGEDOWN:
+            self.top = min(self.top + self.page_height, bottom)
+        elif key == tcod.event.KeySym.HOME:
+            self.top = 0
+        elif key == tcod.event.KeySym.END:
+            self.top = bottom
+        else:
+            # Any other key returns to the game.
+            self.engine.event_handler = MainGameEventHandler(self.engine)
+        return None
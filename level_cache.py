@@ -0,0 +1,163 @@
+"""Pre-generates levels in a process pool and stores them in an on-disk cache"""
+from __future__ import annotations
+
+import argparse
+import random
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional, TYPE_CHECKING
+
+import numpy as np
+
+import entity_factories
+from engine import Engine
+from game_map import GameMap
+from procgen import generate_dungeon
+
+if TYPE_CHECKING:
+    from entity import ActorPrototype
+
+# Bumped when the files change meaning, levels of older versions are then left unused.
+# 2: spawns are stored in store slot order.
+CACHE_VERSION = 2
+
+
+class LevelParams(NamedTuple):
+    """Parameters of generate_dungeon, together with a seed they define a level"""
+    max_rooms: int = 30
+    room_min_size: int = 6
+    room_max_size: int = 10
+    map_width: int = 80
+    map_height: int = 43
+    max_monsters_per_room: int = 2
+
+    @property
+    def key(self):
+        """Name of the cache directory holding the levels generated with these parameters"""
+        return (
+            f"v{CACHE_VERSION}_{self.map_width}x{self.map_height}_rooms{self.max_rooms}"
+            f"_size{self.room_min_size}-{self.room_max_size}_monsters{self.max_monsters_per_room}"
+        )
+
+
+def get_prototype_keys():
+    """Returns the entity_factories.monsters keys of the prototypes, keyed by the names of their actors"""
+    return {prototype.name: key for key, prototype in entity_factories.monsters.items()}
+
+
+def generate_level(params: LevelParams, seed: int, path: Path):
+    """Generates the level and writes its tiles and spawn list to path. Runs in the worker processes"""
+    player = entity_factories.player.build()
+    dungeon = generate_dungeon(*params, Engine(player), seed=seed)
+
+    prototype_keys = get_prototype_keys()
+    kinds = sorted(set(prototype_keys.values()))
+    # In store slot order, which is the order generation spawned them in.
+    spawns = sorted((entity for entity in dungeon.entities if entity is not player), key=lambda entity: entity._slot)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp.npz")
+    np.savez_compressed(
+        tmp_path,
+        seed=np.uint64(seed),
+        tiles=dungeon.tiles,
+        player=np.array([player.x, player.y], dtype=np.int32),
+        kinds=np.array(kinds),
+        spawn_kind=np.array([kinds.index(prototype_keys[entity.name]) for entity in spawns], dtype=np.uint8),
+        spawn_x=np.array([entity.x for entity in spawns], dtype=np.int32),
+        spawn_y=np.array([entity.y for entity in spawns], dtype=np.int32),
+    )
+    tmp_path.replace(path)  # Readers never see a partly written level
+    return path
+
+
+class LevelCache:
+    """Directory of pre-generated levels, one compressed .npz file per (parameters, seed)"""
+    def __init__(self, directory: Path | str, params: LevelParams = LevelParams()):
+        self.params = params
+        self.directory = Path(directory) / params.key
+
+    def get_path(self, seed: int):
+        return self.directory / f"{seed}.npz"
+
+    def seeds(self) -> List[int]:
+        """Returns the seeds of the cached levels"""
+        if not self.directory.exists():
+            return []
+        return sorted(int(path.name[:-len(".npz")]) for path in self.directory.glob("*.npz") if ".tmp" not in path.name)
+
+    def pregenerate(self, seeds: Iterable[int], max_workers: Optional[int] = None) -> List[Path]:
+        """Generates the levels which are not cached yet across a process pool"""
+        missing = [seed for seed in seeds if not self.get_path(seed).exists()]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(generate_level, self.params, seed, self.get_path(seed)) for seed in missing]
+            return [future.result() for future in futures]
+
+    def refill_steps(self, pool_size: int) -> Iterator[Path]:
+        """Generates levels of fresh random seeds in this process, one level per step,
+        until the cache holds pool_size levels. Meant to run as a background job of the GameLoop.
+        """
+        while len(self.seeds()) < pool_size:
+            seed = random.randrange(2 ** 32)
+            path = self.get_path(seed)
+            if not path.exists():
+                yield generate_level(self.params, seed, path)
+
+    def load(self, seed: int, engine: Engine):
+        """Returns the cached level as a new GameMap, with the player of the engine placed on it"""
+        with np.load(self.get_path(seed)) as data:
+            dungeon = GameMap(engine, self.params.map_width, self.params.map_height, entities=[engine.player])
+            dungeon.seed = seed
+            dungeon.tiles[:] = data["tiles"]
+            dungeon.invalidate_tiles()
+            engine.player.place(*data["player"].tolist(), dungeon)
+
+            # Respawn in the order of generation, each run of the same kind at once, so the actors get the
+            # same store slots and scheduling order as on a generated level and the games play the same.
+            kinds = data["kinds"].tolist()
+            positions = np.stack([data["spawn_x"], data["spawn_y"]], axis=1).tolist()
+            spawn_kind = data["spawn_kind"].tolist()
+            start = 0
+            for end in range(1, len(spawn_kind) + 1):
+                if end == len(spawn_kind) or spawn_kind[end] != spawn_kind[start]:
+                    prototype: ActorPrototype = entity_factories.monsters[kinds[spawn_kind[start]]]
+                    prototype.spawn_many(dungeon, positions[start:end])
+                    start = end
+
+        return dungeon
+
+    def load_or_generate(self, engine: Engine, seed: Optional[int] = None):
+        """Loads the level of the seed if it is cached, or generates it on demand.
+        Without a seed any cached level is used, so startup doesn't wait for generation.
+        That level is removed from the cache, so the pool is drawn down and no dungeon is played twice.
+        """
+        if seed is None:
+            cached = self.seeds()
+            if cached:
+                seed = random.choice(cached)
+                dungeon = self.load(seed, engine)
+                self.get_path(seed).unlink(missing_ok=True)
+                return dungeon
+        if seed is not None and self.get_path(seed).exists():
+            return self.load(seed, engine)
+        return generate_dungeon(*self.params, engine, seed=seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generates a pool of levels into the level cache.")
+    parser.add_argument("--directory", default="levels", help="Root directory of the level cache")
+    parser.add_argument("--count", type=int, default=16, help="Number of levels to generate")
+    parser.add_argument("--first-seed", type=int, default=0, help="Seed of the first level, the next ones count up")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    for name, default in LevelParams._field_defaults.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    args = parser.parse_args()
+
+    params = LevelParams(**{name: getattr(args, name) for name in LevelParams._fields})
+    cache = LevelCache(args.directory, params)
+    paths = cache.pregenerate(range(args.first_seed, args.first_seed + args.count), max_workers=args.workers)
+    print(f"Generated {len(paths)} levels in {cache.directory}")
+
+
+if __name__ == '__main__':
+    main()
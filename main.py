@@ -1,10 +1,13 @@
-import copy
 import tcod
 
 import color
 import entity_factories
+from camera import Camera
 from engine import Engine
-from procgen import generate_dungeon
+from game_loop import GameLoop
+from level_cache import LevelCache, LevelParams
+from message_log import MessageLog
+from replay import Recording
 
 
 def main():
@@ -14,32 +17,50 @@ def main():
     map_width = 80
     map_height = 43
 
+    # Area of the console showing the map, the map itself may be larger.
+    viewport_width = 80
+    viewport_height = 43
+
     room_max_size = 10
     room_min_size = 6
     max_rooms = 30
 
     max_monsters_per_room = 2
 
+    seed = None  # Set to an int to generate the same dungeon every run
+
+    # Levels pre-generated with `python -m level_cache` are loaded instead of generated.
+    level_cache = LevelCache(
+        "levels",
+        LevelParams(
+            max_rooms=max_rooms,
+            room_min_size=room_min_size,
+            room_max_size=room_max_size,
+            map_width=map_width,
+            map_height=map_height,
+            max_monsters_per_room=max_monsters_per_room,
+        ),
+    )
+
     tileset = tcod.tileset.load_tilesheet(
         "dejavu10x10_gs_tc.png", 32, 8, tcod.tileset.CHARMAP_TCOD
     )
 
-    player = copy.deepcopy(entity_factories.player)
+    player = entity_factories.player.build()
 
     engine = Engine(player)
+    engine.camera = Camera(viewport_width, viewport_height)
+    # Messages dropped from the log are kept in this file, where the history viewer still reads them.
+    engine.message_log = MessageLog(spill_path="message_history.txt")
 
-    engine.game_map = generate_dungeon(
-        max_rooms,
-        room_min_size,
-        room_max_size,
-        map_width,
-        map_height,
-        max_monsters_per_room,
-        engine,
-    )
+    engine.game_map = level_cache.load_or_generate(engine, seed)
 
     engine.update_fov()
 
+    # The game can be replayed with replay.ReplayDriver(Recording.load("last_game.npz")),
+    # `python -m replay` checks that games on cached levels replay to the same state.
+    engine.recording = Recording(level_cache.params, engine.game_map.seed)
+
     engine.message_log.add_message(
         "Welcome to the dungeon, player!", color.welcome_text
     )
@@ -53,11 +74,14 @@ def main():
         vsync=True,
     ) as context:
         root_console = tcod.console.Console(screen_width, screen_height, order="F")
-        while True:
-
-            engine.render(root_console, context)
-
-            engine.event_handler.handle_events()
+        game_loop = GameLoop(engine, context, root_console)
+        # Tops the level cache up with fresh levels in the idle time, so the next runs start on a cached level.
+        game_loop.add_job(level_cache.refill_steps(pool_size=16))
+        try:
+            game_loop.run()
+        finally:
+            engine.recording.save("last_game.npz")
+            engine.message_log.close()
 
 
 if __name__ == '__main__':
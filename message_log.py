@@ -1,6 +1,13 @@
-from typing import List, Reversible, Tuple
+from __future__ import annotations
+
+from array import array
+from collections import deque
+from pathlib import Path
+from typing import BinaryIO, Deque, Dict, List, Optional, Reversible, Tuple
+import re
 import textwrap
 
+import numpy as np
 import tcod
 
 import color
@@ -10,7 +17,18 @@ class Message:
     def __init__(self, text: str, fg: Tuple[int, int, int]):
         self.plain_text = text
         self.fg = fg
-        self.count = 1
+        self._count = 1
+        # Wrapped lines of the full text keyed by width, dropped whenever the count changes.
+        self._lines: Dict[int, List[str]] = {}
+
+    @property
+    def count(self):
+        return self._count
+
+    @count.setter
+    def count(self, value: int):
+        self._count = value
+        self._lines.clear()
 
     @property
     def full_text(self):
@@ -19,10 +37,45 @@ class Message:
             return f"{self.plain_text} (x{self.count})"
         return self.plain_text
 
+    def wrap(self, width: int) -> List[str]:
+        """Returns the full text wrapped to the width, cached until the count changes"""
+        lines = self._lines.get(width)
+        if lines is None:
+            lines = self._lines[width] = textwrap.wrap(self.full_text, width)
+        return lines
+
 
 class MessageLog:
-    def __init__(self):
-        self.messages = []
+    """
+    Keeps the last capacity messages, the oldest ones are dropped as new ones arrive.
+    With a spill_path the dropped messages are written to that text file instead of being lost, one
+    "#rrggbb text" line each, and indexed so the whole history can still be read with get_message.
+    Every message ever added has an index in the order it was added, counting the dropped ones,
+    which snapshots use to find their place in the log.
+    """
+    def __init__(self, capacity: int = 1024, spill_path: Optional[Path | str] = None):
+        self.messages: Deque[Message] = deque(maxlen=capacity)
+        self.dropped = 0  # Number of messages dropped from the log, spilled or not
+        self.spill_path = spill_path
+        self._spill_file: Optional[BinaryIO] = None
+        self._spill_reader: Optional[BinaryIO] = None
+        # Position of every spilled message in the spill file.
+        self._spill_offsets = array("q")
+        # Wrapped line count of every spilled message, by the widths line_offsets was called with.
+        self._spill_lines: Dict[int, array] = {}
+        self.version = 0  # Changes whenever a message is added or stacked
+        # Lines drawn by the last render and the (version, width, height) they were laid out for.
+        self._layout: List[Tuple[int, str, Tuple[int, int, int]]] = []
+        self._layout_key: Optional[Tuple[int, int, int]] = None
+
+    def __len__(self):
+        """Number of messages in the whole history, the spilled ones included"""
+        return len(self._spill_offsets) + len(self.messages)
+
+    @property
+    def end(self) -> int:
+        """Index of the next message added: the number of messages added so far, the dropped ones included"""
+        return self.dropped + len(self.messages)
 
     def add_message(self, text: str, fg: Tuple[int, int, int] = color.white, *, stack: bool = True):
         """
@@ -31,15 +84,131 @@ class MessageLog:
         """
         if stack and self.messages and text == self.messages[-1].plain_text:
             self.messages[-1].count += 1
+            self.version += 1
         else:
-            self.messages.append(Message(text, fg))
+            self.append(Message(text, fg))
+
+    def append(self, message: Message):
+        """Appends the message as it is, spilling the oldest message if the log is full"""
+        if len(self.messages) == self.messages.maxlen:
+            if self.spill_path is not None:
+                self._spill(self.messages[0])
+            self.dropped += 1
+        self.messages.append(message)
+        self.version += 1
+
+    def truncate(self, end: int):
+        """
+        Drops the messages added from index end on, as when the game is rolled back.
+        The spill file is cut back to the messages before end, and the spilled messages which fit into the
+        log again are read back into it. Messages dropped without a spill file don't come back.
+        """
+        while self.messages and self.end > end:
+            self.messages.pop()
+        if self.dropped > end:
+            self._truncate_spill(end)
+            self.dropped = end
+        while (len(self.messages) < self.messages.maxlen
+               and 0 < self.dropped == len(self._spill_offsets)):
+            self.messages.appendleft(self.get_message(self.dropped - 1))
+            self._truncate_spill(self.dropped - 1)
+            self.dropped -= 1
+        self.version += 1
+
+    def _spill(self, message: Message):
+        if self._spill_file is None:
+            self._spill_file = open(self.spill_path, "wb")
+        for width, counts in self._spill_lines.items():
+            counts.append(len(message.wrap(width)))
+        self._spill_offsets.append(self._spill_file.tell())
+        red, green, blue = message.fg
+        self._spill_file.write(f"#{red:02x}{green:02x}{blue:02x} {message.full_text}\n".encode("utf-8"))
+
+    def _truncate_spill(self, count: int):
+        """Forgets the spilled messages after the first count, the spill file is cut back to match"""
+        if count >= len(self._spill_offsets):
+            return
+        offset = self._spill_offsets[count]
+        del self._spill_offsets[count:]
+        for counts in self._spill_lines.values():
+            del counts[count:]
+        self._spill_file.truncate(offset)
+        self._spill_file.seek(offset)
+
+    def get_added_message(self, index: int) -> Optional[Message]:
+        """Returns the message added at index, None if it was dropped without being spilled"""
+        if index >= self.dropped:
+            return self.messages[index - self.dropped]
+        if self.dropped == len(self._spill_offsets):
+            return self.get_message(index)
+        return None
+
+    def get_message(self, index: int) -> Message:
+        """Returns the message at index in the whole history, reading it back from the spill file if it was spilled"""
+        spilled = len(self._spill_offsets)
+        if index >= spilled:
+            return self.messages[index - spilled]
+        if self._spill_reader is None:
+            self._spill_reader = open(self.spill_path, "rb")
+        self._spill_file.flush()
+        self._spill_reader.seek(self._spill_offsets[index])
+        fg, text = self._spill_reader.readline().decode("utf-8").rstrip("\n").split(" ", 1)
+        # The count of a stacked message was written as part of its full text.
+        stacked = re.fullmatch(r"(.*) \(x(\d+)\)", text, re.DOTALL)
+        message = Message(stacked[1] if stacked else text, (int(fg[1:3], 16), int(fg[3:5], 16), int(fg[5:7], 16)))
+        if stacked:
+            message.count = int(stacked[2])
+        return message
+
+    def close(self):
+        """Closes the spill file, if any was opened"""
+        for file in self._spill_file, self._spill_reader:
+            if file is not None:
+                file.close()
+        self._spill_file = self._spill_reader = None
 
     def render(self, console: tcod.Console, x: int, y: int, width: int, height: int):
-        """Renders this log over the given area. Log is the rectangular area with x, y, width, height"""
-        self.render_messages(console, x, y, width, height, self.messages)
+        """Renders this log over the given area. Log is the rectangular area with x, y, width, height.
+        The lines are only laid out again after the log or the size of the area changed.
+        """
+        if self._layout_key != (self.version, width, height):
+            self._layout_key = self.version, width, height
+            self._layout = self.layout_messages(width, height, self.messages)
+        for y_offset, line, fg in self._layout:
+            console.print(x=x, y=y + y_offset, string=line, fg=fg)
+
+    def line_offsets(self, width: int) -> np.ndarray:
+        """Returns the index of the first wrapped line of every message in the whole history,
+        followed by the total line count. The line counts of the spilled messages are kept for each
+        width, so only the messages spilled since the last call with the width are read back.
+        """
+        counts = self._spill_lines.setdefault(width, array("q"))
+        for index in range(len(counts), len(self._spill_offsets)):
+            counts.append(len(self.get_message(index).wrap(width)))
+        offsets = np.zeros(len(self) + 1, dtype=np.intp)
+        np.cumsum(
+            np.concatenate([np.frombuffer(counts, dtype=np.int64), [len(message.wrap(width)) for message in self.messages]]),
+            out=offsets[1:],
+        )
+        return offsets
 
     @staticmethod
+    def layout_messages(width: int, height: int, messages: Reversible[Message]):
+        """Returns the (y offset, line, color) of the lines showing the last messages in the area"""
+        layout = []
+        y_offset = height - 1
+
+        for message in reversed(messages):
+            for line in reversed(message.wrap(width)):
+                layout.append((y_offset, line, message.fg))
+                y_offset -= 1
+                if y_offset < 0:
+                    return layout  # No more space in the message log
+        return layout
+
+    @classmethod
     def render_messages(
+            cls,
             console: tcod.Console,
             x: int,
             y: int,
@@ -48,11 +217,5 @@ class MessageLog:
             messages: Reversible[Message]
     ):
         """Renders the message provided. Messages are rendered backwards"""
-        y_offset = height - 1
-
-        for message in reversed(messages):
-            for line in reversed(textwrap.wrap(message.full_text, width)):
-                console.print(x=x, y=y + y_offset, string=line, fg=message.fg)
-                y_offset -= 1
-                if y_offset < 0:
-                    return   # No more space in the message log
+        for y_offset, line, fg in cls.layout_messages(width, height, messages):
+            console.print(x=x, y=y + y_offset, string=line, fg=fg)
@@ -1,8 +1,7 @@
 from __future__ import annotations
 
 import random
-import tcod
-from typing import Tuple, TYPE_CHECKING
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
 
 from game_map import GameMap
 import entity_factories
@@ -10,6 +9,7 @@ import tile_types
 
 if TYPE_CHECKING:
     from engine import Engine
+    from tile_storage import TileArray
 
 
 class RectangularRoom:
@@ -33,6 +33,19 @@ class RectangularRoom:
         """Returns inner area of the room"""
         return slice(self.x1 + 1, self.x2), slice(self.y1 + 1, self.y2)  # adds 1 to not include walls
 
+    @property
+    def outer(self):
+        """Returns the whole area of the room, walls included"""
+        return slice(self.x1, self.x2 + 1), slice(self.y1, self.y2 + 1)
+
+    def get_buckets(self, bucket_size: int):
+        """Returns the (x, y) keys of the bucket_size square buckets the room touches, walls included"""
+        return [
+            (bucket_x, bucket_y)
+            for bucket_x in range(self.x1 // bucket_size, self.x2 // bucket_size + 1)
+            for bucket_y in range(self.y1 // bucket_size, self.y2 // bucket_size + 1)
+        ]
+
     def intersects(self, other):
         """Return True if this room overlaps with another RectangularRoom."""
         return (
@@ -44,41 +57,46 @@ class RectangularRoom:
 
 
 def place_entities(
-        room: RectangularRoom, dungeon: GameMap, maximum_monsters: int
+        room: RectangularRoom, dungeon: GameMap, maximum_monsters: int, rng: random.Random
 ):
     """Placing entities in random positions in the room"""
 
-    number_of_monsters = random.randint(0, maximum_monsters)
+    number_of_monsters = rng.randint(0, maximum_monsters)
+    orc_positions = []
+    troll_positions = []
 
     for i in range(number_of_monsters):
-        x = random.randint(room.x1 + 1, room.x2 - 1)
-        y = random.randint(room.y1 + 1, room.y2 - 1)
+        x = rng.randint(room.x1 + 1, room.x2 - 1)
+        y = rng.randint(room.y1 + 1, room.y2 - 1)
 
-        if not any(entity.x == x and entity.y == y for entity in dungeon.entities):
-            if random.random() < 0.8:
-                entity_factories.orc.spawn(dungeon, x, y)   # 0.2 chance for the orc
+        taken = (x, y) in orc_positions or (x, y) in troll_positions
+        if not taken and not dungeon.get_blocking_entity_at_location(x, y):
+            if rng.random() < 0.8:
+                orc_positions.append((x, y))   # 0.8 chance for the orc
             else:
-                entity_factories.troll.spawn(dungeon, x, y)    # 0.8 chance for the orc
+                troll_positions.append((x, y))    # 0.2 chance for the troll
+
+    entity_factories.orc.spawn_many(dungeon, orc_positions)
+    entity_factories.troll.spawn_many(dungeon, troll_positions)
 
 
 def tunnel_between(
-    start: Tuple[int, int], end: Tuple[int, int]
-):
-    """Return an L-shaped tunnel between these two points."""
+    start: Tuple[int, int], end: Tuple[int, int], rng: random.Random
+) -> List[Tuple[slice, slice]]:
+    """Return an L-shaped tunnel between these two points, as the index of its two straight segments."""
     x1, y1 = start
     x2, y2 = end
-    if random.random() < 0.5:  # 50% chance.
+    if rng.random() < 0.5:  # 50% chance.
         # Move horizontally, then vertically.
         corner_x, corner_y = x2, y1
     else:
         # Move vertically, then horizontally.
         corner_x, corner_y = x1, y2
 
-    # Generate the coordinates for this tunnel.
-    for x, y in tcod.los.bresenham((x1, y1), (corner_x, corner_y)).tolist():
-        yield x, y
-    for x, y in tcod.los.bresenham((corner_x, corner_y), (x2, y2)).tolist():
-        yield x, y
+    return [
+        (slice(min(x1, corner_x), max(x1, corner_x) + 1), slice(min(y1, corner_y), max(y1, corner_y) + 1)),
+        (slice(min(corner_x, x2), max(corner_x, x2) + 1), slice(min(corner_y, y2), max(corner_y, y2) + 1)),
+    ]
 
 
 def generate_dungeon(
@@ -89,34 +107,55 @@ def generate_dungeon(
     map_height: int,
     max_monsters_per_room: int,
     engine: Engine,
+    seed: Optional[int] = None,
+    tiles: Optional[TileArray] = None,
 ):
-    """Returns generated dungeon with rooms and tunnels"""
+    """Returns generated dungeon with rooms and tunnels.
+    The same seed and parameters always generate the same dungeon, a random seed is picked if none is given.
+    All randomness comes from a Random instance of this call, so generation never touches the global random state.
+    tiles is an optional storage of wall tiles to carve the dungeon into, such as a ChunkedTiles.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    rng = random.Random(seed)
 
     player = engine.player
-    dungeon = GameMap(engine, map_width, map_height, entities=[player])
+    dungeon = GameMap(engine, map_width, map_height, entities=[player], tiles=tiles)
+    dungeon.seed = seed
     rooms = []
+    # The rooms so far by the room_max_size square buckets their walls touch, so each overlap test only
+    # looks at the nearby rooms. No per-cell mask is allocated, maps can be larger than the memory.
+    room_buckets: Dict[Tuple[int, int], List[RectangularRoom]] = {}
+    # Areas to be carved into floor, written to the tiles in one pass at the end.
+    floor: List[Tuple[slice, slice]] = []
     for r in range(max_rooms):
-        room_width = random.randint(room_min_size, room_max_size)
-        room_height = random.randint(room_min_size, room_max_size)
+        room_width = rng.randint(room_min_size, room_max_size)
+        room_height = rng.randint(room_min_size, room_max_size)
 
-        x = random.randint(0, dungeon.width - room_width - 1)
-        y = random.randint(0, dungeon.height - room_height - 1)
+        x = rng.randint(0, dungeon.width - room_width - 1)
+        y = rng.randint(0, dungeon.height - room_height - 1)
 
         new_room = RectangularRoom(x, y, room_width, room_height)
 
-        if any(new_room.intersects(other_room) for other_room in rooms):
-            continue
+        buckets = new_room.get_buckets(room_max_size)
+        if any(new_room.intersects(other) for bucket in buckets for other in room_buckets.get(bucket, ())):
+            continue  # The new room intersects one of the previous rooms
+        for bucket in buckets:
+            room_buckets.setdefault(bucket, []).append(new_room)
 
-        dungeon.tiles[new_room.inner] = tile_types.floor  # Populating inner area of the room with floor tiles
+        floor.append(new_room.inner)  # Populating inner area of the room with floor tiles
 
         if len(rooms) == 0:
             player.place(*new_room.center, dungeon)  # Places the player in the first room
         else:
-            for x, y in tunnel_between(rooms[-1].center, new_room.center):
-                dungeon.tiles[x, y] = tile_types.floor  # Populating inner area of the tunnel with floor tiles
+            floor.extend(tunnel_between(rooms[-1].center, new_room.center, rng))
 
-        place_entities(new_room, dungeon, max_monsters_per_room)  # Populating rooms with entities
+        place_entities(new_room, dungeon, max_monsters_per_room, rng)  # Populating rooms with entities
 
         rooms.append(new_room)
 
+    for area in floor:
+        dungeon.tiles[area] = tile_types.floor
+    dungeon.invalidate_tiles()
+
     return dungeon
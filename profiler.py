@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import json
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, IO, Optional, TYPE_CHECKING
+
+import numpy as np
+
+import color
+
+if TYPE_CHECKING:
+    from tcod.console import Console
+
+
+class _NullTimer:
+    """Context manager doing nothing, returned by a disabled Profiler so instrumented code costs almost nothing"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+        self.outer_phase: Optional[str] = None
+
+    def __enter__(self):
+        self.outer_phase = self.profiler.current_phase
+        self.profiler.current_phase = self.name
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.turn_times[self.name] += time.perf_counter() - self.start
+        self.profiler.current_phase = self.outer_phase
+        return False
+
+
+class Profiler:
+    """
+    Per-phase timers and counters of the Engine, aggregated per turn.
+    The totals of the last `history` turns are kept for percentiles and histograms,
+    and every turn can be written to a JSON lines dump.
+    While disabled, phase() returns a shared no-op timer and count() returns at once.
+    """
+    def __init__(self, history: int = 256):
+        self.enabled = False
+        self.show_overlay = False
+        self.turn = 0
+        self.turn_times: Dict[str, float] = defaultdict(float)
+        self.turn_counts: Dict[str, int] = defaultdict(int)
+        self.history: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=history))
+        self.history_length = history
+        self.dump: Optional[IO[str]] = None
+        self.current_phase: Optional[str] = None  # Innermost phase being timed
+
+    def phase(self, name: str):
+        """Returns a context manager adding the time spent inside it to the phase"""
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, name)
+
+    def count(self, name: str, amount: int = 1, phase: Optional[str] = None):
+        """Adds amount to the counter of the current turn.
+        With a phase the counter is kept per phase, as "<phase>.<name>", like the timers of AI classes.
+        """
+        if self.enabled:
+            self.turn_counts[f"{phase}.{name}" if phase else name] += amount
+
+    def open_dump(self, path: str):
+        """Starts writing one JSON object per turn to path"""
+        self.dump = open(path, "a", encoding="utf-8")
+
+    def close_dump(self):
+        if self.dump:
+            self.dump.close()
+            self.dump = None
+
+    def end_turn(self):
+        """Moves the timers and counters of the current turn into the history"""
+        if not self.enabled:
+            return
+        self.turn += 1
+        for name, seconds in self.turn_times.items():
+            self.history[name].append(seconds)
+        if self.dump:
+            self.dump.write(json.dumps({
+                "turn": self.turn,
+                "ms": {name: round(seconds * 1e3, 4) for name, seconds in self.turn_times.items()},
+                "counts": dict(self.turn_counts),
+            }) + "\n")
+        self.turn_times.clear()
+        self.turn_counts.clear()
+
+    def histogram(self, name: str, bins: int = 10):
+        """Returns the (counts, bin edges in ms) of the phase times over the recent turns"""
+        return np.histogram(np.array(self.history[name]) * 1e3, bins=bins)
+
+    def summary(self):
+        """Returns the p50, p95 and max time in ms of every phase over the recent turns"""
+        result = {}
+        for name, times in self.history.items():
+            if times:
+                p50, p95, p_max = np.percentile(np.array(times) * 1e3, [50, 95, 100]).tolist()
+                result[name] = {"p50": p50, "p95": p95, "max": p_max}
+        return result
+
+    def render(self, console: Console, x: int, y: int):
+        """Draws the p50/p95 phase times of the recent turns as an overlay"""
+        for offset, (name, stats) in enumerate(sorted(self.summary().items())):
+            console.print(
+                x=x, y=y + offset, string=f"{name:<20}{stats['p50']:8.3f}{stats['p95']:8.3f} ms",
+                fg=color.white, bg=color.black,
+            )
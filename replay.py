@@ -0,0 +1,178 @@
+"""
+Deterministic recordings of games and their headless replay.
+
+A game is fully determined by the level parameters, the procgen seed and the player's actions,
+so a recording stores only those: one byte per turn, 0 to wait and 1 + the index in DIRECTIONS to bump.
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+
+import entity_factories
+from actions import Action, BumpAction, WaitAction
+from engine import Engine
+from entity_store import FIELDS
+from headless import DIRECTIONS, HeadlessDriver, random_policy
+from level_cache import LevelCache, LevelParams, generate_level
+from snapshot import Snapshot
+
+WAIT = 0
+
+
+class Recording:
+    """Seed, level parameters and the action codes of the turns of one game"""
+    def __init__(self, params: LevelParams, seed: int, moves: bytes = b""):
+        self.params = params
+        self.seed = seed
+        self.moves = bytearray(moves)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def record(self, action: Action):
+        """Appends the action the player has taken this turn"""
+        if isinstance(action, WaitAction):
+            self.moves.append(WAIT)
+        elif isinstance(action, BumpAction):
+            self.moves.append(1 + DIRECTIONS.index((action.dx, action.dy)))
+        else:
+            raise TypeError(f"{type(action).__name__} can't be recorded")
+
+    def get_action(self, engine: Engine, turn: int) -> Action:
+        """Returns the action of the player of the engine in the turn"""
+        code = self.moves[turn]
+        if code == WAIT:
+            return WaitAction(engine.player)
+        return BumpAction(engine.player, *DIRECTIONS[code - 1])
+
+    def save(self, path: Path | str):
+        np.savez_compressed(
+            path,
+            params=np.array(self.params, dtype=np.int32),
+            seed=np.uint64(self.seed),
+            moves=np.frombuffer(bytes(self.moves), dtype=np.uint8),
+        )
+
+    @classmethod
+    def load(cls, path: Path | str):
+        with np.load(path) as data:
+            return cls(LevelParams(*data["params"].tolist()), int(data["seed"]), data["moves"].tobytes())
+
+
+class ReplayDriver(HeadlessDriver):
+    """
+    Replays a Recording without a window. Turns are fast-forwarded without rendering,
+    and a Snapshot is kept every snapshot_interval turns so seeking to any turn only
+    replays the turns since the closest snapshot before it.
+    """
+    def __init__(
+            self,
+            recording: Recording,
+            snapshot_interval: int = 100,
+            render: bool = False,
+            viewport: Tuple[int, int] = (80, 43),
+    ):
+        super().__init__(recording.params, recording.seed, render, viewport)
+        self.recording = recording
+        self.snapshot_interval = snapshot_interval
+        self.snapshots: Dict[int, Snapshot] = {0: Snapshot(self.engine)}
+
+    def fast_forward(self, turn: int):
+        """Plays the recorded turns up to turn without rendering"""
+        while self.turn < turn:
+            self.engine.take_turn(self.recording.get_action(self.engine, self.turn))
+            self.turn += 1
+            if self.turn % self.snapshot_interval == 0 and self.turn not in self.snapshots:
+                parent = self.snapshots[max(snapshot_turn for snapshot_turn in self.snapshots if snapshot_turn < self.turn)]
+                self.snapshots[self.turn] = Snapshot(self.engine, parent)
+
+    def seek(self, turn: int):
+        """Puts the game into its state after turn turns, then renders it if rendering is on"""
+        if not 0 <= turn <= len(self.recording):
+            raise ValueError(f"Turn {turn} is not in the recording of {len(self.recording)} turns")
+        closest = max(snapshot_turn for snapshot_turn in self.snapshots if snapshot_turn <= turn)
+        if turn < self.turn or closest > self.turn:
+            self.snapshots[closest].restore(self.engine)
+            self.turn = closest
+        self.fast_forward(turn)
+        if self.console:
+            self.engine.render(self.console, None)
+
+
+def get_game_state(engine: Engine):
+    """Returns a comparable summary of the game of the engine: the store rows and AI state of the
+    entities in store slot order, the visible and explored cells and the messages
+    """
+    game_map = engine.game_map
+    store = game_map.store
+    entities = sorted(game_map.entities, key=lambda entity: entity._slot)
+    return (
+        [getattr(store, name)[:store.size].tobytes() for name, _, _ in FIELDS],
+        [
+            (entity._slot, entity.name, getattr(entity.ai, "last_seen", None), getattr(entity.ai, "path", None))
+            for entity in entities
+        ],
+        [actor._slot for actor in game_map.scheduler.actors],
+        np.argwhere(game_map.visible).tobytes(),
+        np.argwhere(game_map.explored).tobytes(),
+        [message.full_text for message in engine.message_log.messages],
+    )
+
+
+def check_replay(cache: LevelCache, seed: int, turns: int = 1000, policy_seed: int = 0):
+    """Plays random turns on the cached level of the seed and records them as main does, then replays the
+    recording on a generated level. Returns True if both games end in the same state.
+    """
+    path = cache.get_path(seed)
+    if not path.exists():
+        generate_level(cache.params, seed, path)
+
+    engine = Engine(entity_factories.player.build())
+    engine.game_map = cache.load(seed, engine)
+    engine.update_fov()
+    engine.recording = Recording(cache.params, seed)
+    policy = random_policy(random.Random(policy_seed))
+    for _ in range(turns):
+        if not engine.player.is_alive:
+            break
+        engine.take_turn(policy(engine))
+
+    replay = ReplayDriver(engine.recording)
+    replay.seek(len(engine.recording))
+    return get_game_state(engine) == get_game_state(replay.engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks that games played on cached levels replay to the same state.")
+    parser.add_argument("--directory", default=None, help="Root directory of the level cache, a temporary one by default")
+    parser.add_argument("--count", type=int, default=8, help="Number of levels to check")
+    parser.add_argument("--first-seed", type=int, default=0, help="Seed of the first level, the next ones count up")
+    parser.add_argument("--turns", type=int, default=1000, help="Number of turns played on each level")
+    for name, default in LevelParams._field_defaults.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    args = parser.parse_args()
+
+    params = LevelParams(**{name: getattr(args, name) for name in LevelParams._fields})
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        cache = LevelCache(args.directory or temporary_directory, params)
+        failed = []
+        for seed in range(args.first_seed, args.first_seed + args.count):
+            matches = check_replay(cache, seed, args.turns)
+            print(f"Seed {seed}: {'ok' if matches else 'replay differs from the cached game'}")
+            if not matches:
+                failed.append(seed)
+    if failed:
+        print(f"{len(failed)} of {args.count} replays differ")
+        sys.exit(1)
+    print(f"All {args.count} replays match")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""
+Compact binary save files.
+
+Layout: MAGIC, a little-endian uint32 format version, a uint32 header length and a JSON header,
+then the data sections, each starting on an ALIGNMENT boundary so uncompressed sections can be
+memory-mapped. The header describes every section by offset, size, dtype, shape and compression.
+Tiles kept in a palette based storage are saved as their palette ids, with the palette, and come back
+in the same kind of storage. Actors are stored as columns, one section per EntityStore field.
+"""
+from __future__ import annotations
+
+import json
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+import numpy as np
+
+from components.ai import BaseAI, HostileEnemy
+from components.fighter import Fighter
+from engine import Engine
+from entity import Actor
+from entity_store import FIELDS
+from game_map import GameMap
+from input_handlers import GameOverEventHandler
+from message_log import Message
+from tile_storage import ChunkedTiles, PaletteTiles
+import tile_types
+
+MAGIC = b"RLSAVE\0\0"
+VERSION = 2
+ALIGNMENT = 64
+# Most bytes of a section converted at once while writing it, so huge tile sections are never copied whole.
+SLAB_BYTES = 1 << 24
+
+# AI classes by the name stored in the saves.
+AI_CLASSES: Dict[str, Type[BaseAI]] = {cls.__name__: cls for cls in (HostileEnemy,)}
+
+
+def _align(offset: int):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _encode_strings(strings: List[str]):
+    """Packs the strings into one NUL separated buffer"""
+    return np.frombuffer("\0".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _decode_strings(buffer: np.ndarray, count: int):
+    if count == 0:
+        return []
+    return buffer.tobytes().decode("utf-8").split("\0")
+
+
+def _iter_bytes(array: np.ndarray, order: str) -> Iterable[bytes]:
+    """Yields the bytes of the array in the order, a slab along its outer axis at a time"""
+    array = np.atleast_1d(array.T if order == "F" else array)
+    step = max(SLAB_BYTES // max(array[:1].nbytes, 1), 1)
+    for start in range(0, len(array), step):
+        yield array[start:start + step].tobytes()
+
+
+def _get_palette_mapping(saved_palette: np.ndarray) -> Optional[np.ndarray]:
+    """Returns the current palette ids of the saved palette ids, None if they are the same"""
+    palette = tile_types.palette
+    if saved_palette.dtype == palette.dtype and saved_palette.tobytes() == palette[:len(saved_palette)].tobytes():
+        return None
+    return tile_types.get_tile_ids(saved_palette)
+
+
+def _unchunk_ids(ids: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Returns the (chunks x, chunks y, chunk size, chunk size) ids of ChunkedTiles as a width x height array"""
+    columns, rows, size, _ = ids.shape
+    return np.asfortranarray(ids.transpose(0, 2, 1, 3).reshape(columns * size, rows * size)[:width, :height])
+
+
+def save_game(engine: Engine, path: Path | str, compress: bool = False):
+    """Writes the game map, its actors and the message log of the engine to path.
+    With compress the sections are zlib compressed, which makes the file smaller but rules out memory-mapping.
+    """
+    game_map = engine.game_map
+    store = game_map.store
+    actors = [entity for entity in game_map.entities if isinstance(entity, Actor)]
+    slots = np.array([actor._slot for actor in actors], dtype=np.intp)
+    messages = engine.message_log.messages
+    # The paths of all the actors are stored end to end, actor i's from path_offsets[i] to path_offsets[i + 1].
+    paths = [getattr(actor.ai, "path", None) or [] for actor in actors]
+    path_offsets = np.zeros(len(actors) + 1, dtype=np.int64)
+    np.cumsum([len(path) for path in paths], out=path_offsets[1:])
+
+    tiles = game_map.tiles
+    tile_header = {}
+    arrays: Dict[str, np.ndarray] = {}
+    if isinstance(tiles, (ChunkedTiles, PaletteTiles)):
+        # The ids are saved as they are laid out, chunk by chunk for ChunkedTiles, and never expanded to tile_dt.
+        tile_header["tile_storage"] = "chunked" if isinstance(tiles, ChunkedTiles) else "palette"
+        if isinstance(tiles, ChunkedTiles):
+            tile_header["chunk_size"] = tiles.chunk_size
+        arrays["tile_ids"] = tiles.ids
+        arrays["tile_palette"] = tile_types.palette
+    else:
+        tile_header["tile_storage"] = "dense"
+        arrays["tiles"] = np.asarray(tiles)
+    arrays.update({
+        "visible": game_map.visible,
+        "explored": game_map.explored,
+        "actor_names": _encode_strings([actor.name for actor in actors]),
+        "actor_ai": _encode_strings([type(actor.ai).__name__ if actor.ai else "" for actor in actors]),
+        "actor_last_seen": np.array(
+            [getattr(actor.ai, "last_seen", None) or (-1, -1) for actor in actors], dtype=np.int32
+        ).reshape(-1, 2),
+        "actor_path": np.array([step for path in paths for step in path], dtype=np.int32).reshape(-1, 2),
+        "actor_path_offsets": path_offsets,
+        "message_text": _encode_strings([message.plain_text for message in messages]),
+        "message_fg": np.array([message.fg for message in messages], dtype=np.uint8).reshape(-1, 3),
+        "message_count": np.array([message.count for message in messages], dtype=np.int32),
+    })
+    for name, _, _ in FIELDS:
+        arrays[f"actor_{name}"] = getattr(store, name)[slots]
+
+    sections = {}
+    payloads: List[Tuple[int, Iterable[bytes]]] = []
+    offset = 0
+    for name, array in arrays.items():
+        order = "F" if array.ndim > 1 and array.flags.f_contiguous and not array.flags.c_contiguous else "C"
+        if compress:
+            compressor = zlib.compressobj(1)
+            data = [compressor.compress(part) for part in _iter_bytes(array, order)]
+            data.append(compressor.flush())
+            nbytes = sum(map(len, data))
+        else:
+            # Converted only while writing.
+            data = _iter_bytes(array, order)
+            nbytes = array.nbytes
+        offset = _align(offset)
+        sections[name] = {
+            "offset": offset,
+            "nbytes": nbytes,
+            "dtype": np.lib.format.dtype_to_descr(array.dtype),
+            "shape": list(array.shape),
+            "order": order,
+            "compressed": compress,
+        }
+        payloads.append((offset, data))
+        offset += nbytes
+
+    header = json.dumps({
+        "width": game_map.width,
+        "height": game_map.height,
+        "seed": game_map.seed,
+        **tile_header,
+        "player": actors.index(engine.player),
+        "actor_count": len(actors),
+        "message_count": len(messages),
+        "sections": sections,
+    }).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    with open(path, "wb") as file:
+        file.write(MAGIC)
+        file.write(np.array([VERSION, len(header)], dtype="<u4").tobytes())
+        file.write(header)
+        for section_offset, data in payloads:
+            file.seek(data_start + section_offset)
+            for part in data:
+                file.write(part)
+
+
+def _read_header(file):
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a save file")
+    version, header_length = np.frombuffer(file.read(8), dtype="<u4").tolist()
+    if version != VERSION:
+        raise ValueError(f"Unsupported save version {version}, expected {VERSION}")
+    header = json.loads(file.read(header_length).decode("utf-8"))
+    return header, _align(len(MAGIC) + 8 + header_length)
+
+
+def load_game(path: Path | str, mmap: bool = True) -> Engine:
+    """Returns a new Engine with the game saved in path.
+    With mmap the uncompressed tiles are memory-mapped copy-on-write instead of read, so loading a
+    huge map only reads the pages that are used and changes never reach the file. Saved ChunkedTiles
+    only come back as ChunkedTiles mapped over the save file that way, otherwise their ids are read
+    into PaletteTiles.
+    """
+    with open(path, "rb") as file:
+        header, data_start = _read_header(file)
+
+        def read(name: str) -> np.ndarray:
+            section = header["sections"][name]
+            dtype = np.lib.format.descr_to_dtype(section["dtype"])
+            shape = tuple(section["shape"])
+            if mmap and not section["compressed"] and name in ("tiles", "tile_ids"):
+                return np.memmap(
+                    path, dtype=dtype, mode="c", offset=data_start + section["offset"], shape=shape,
+                    order=section["order"],
+                )
+            file.seek(data_start + section["offset"])
+            data = file.read(section["nbytes"])
+            if section["compressed"]:
+                data = zlib.decompress(data)
+            return np.frombuffer(data, dtype=dtype).reshape(shape, order=section["order"]).copy(order="K")
+
+        width, height = header["width"], header["height"]
+        storage = header["tile_storage"]
+        if storage == "dense":
+            tiles = read("tiles")
+        else:
+            mapping = _get_palette_mapping(read("tile_palette"))
+            section = header["sections"]["tile_ids"]
+            if storage == "chunked" and mmap and not section["compressed"] and mapping is None:
+                tiles = ChunkedTiles(
+                    path, width, height, header["chunk_size"], mode="c", offset=data_start + section["offset"]
+                )
+            else:
+                ids = read("tile_ids")
+                if storage == "chunked":
+                    ids = _unchunk_ids(ids, width, height)
+                if mapping is not None:
+                    ids = np.asfortranarray(mapping[ids])
+                tiles = PaletteTiles(width, height)
+                tiles.ids = ids
+
+        engine = Engine(player=None)
+        game_map = GameMap(engine, width, height, tiles=tiles)
+        game_map.seed = header["seed"]
+        # Only the set cells are written, so the untouched parts of the masks of a huge map take no memory.
+        game_map.explored[np.nonzero(read("explored"))] = True
+        xs, ys = np.nonzero(read("visible"))
+        if len(xs):
+            game_map.visible[xs, ys] = True
+            game_map.fov_window = np.s_[xs.min():xs.max() + 1, ys.min():ys.max() + 1]
+        game_map.invalidate_tiles()
+
+        count = header["actor_count"]
+        store = game_map.store
+        slots = store.allocate_many(count)
+        for name, _, _ in FIELDS:
+            getattr(store, name)[slots] = read(f"actor_{name}")
+
+        names = _decode_strings(read("actor_names"), count)
+        ai_names = _decode_strings(read("actor_ai"), count)
+        last_seen = read("actor_last_seen").tolist()
+        steps = read("actor_path").tolist()
+        path_offsets = read("actor_path_offsets").tolist()
+        actors = []
+        for index, (slot, name, ai_name, seen) in enumerate(zip(slots.tolist(), names, ai_names, last_seen)):
+            actor = Actor.bind(game_map, slot, name, AI_CLASSES.get(ai_name), Fighter.__new__(Fighter))
+            path = steps[path_offsets[index]:path_offsets[index + 1]]
+            if actor.ai and (seen[0] >= 0 or path):
+                if seen[0] >= 0:
+                    actor.ai.last_seen = tuple(seen)
+                actor.ai.path = [tuple(step) for step in path]
+                game_map.scheduler.update_awake(actor)
+            actors.append(actor)
+
+        texts = _decode_strings(read("message_text"), header["message_count"])
+        for text, fg, message_count in zip(texts, read("message_fg").tolist(), read("message_count").tolist()):
+            message = Message(text, tuple(fg))
+            message.count = message_count
+            engine.message_log.append(message)
+
+    engine.game_map = game_map
+    engine.player = actors[header["player"]]
+    if not engine.player.is_alive:
+        engine.event_handler = GameOverEventHandler(engine)
+    return engine
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+from collections import deque
+from typing import Deque, Dict, List, Optional, TYPE_CHECKING
+
+import entity_factories
+from actions import Action, BumpAction, WaitAction
+from engine import Engine
+from entity_store import EntityStore
+from level_cache import LevelParams
+from procgen import generate_dungeon
+from tile_storage import PaletteTiles
+
+if TYPE_CHECKING:
+    from entity import Actor
+
+# Commands of the socket protocol: the vi movement keys, and "." to wait.
+COMMANDS = {
+    "h": (-1, 0),
+    "j": (0, 1),
+    "k": (0, -1),
+    "l": (1, 0),
+    "y": (-1, -1),
+    "u": (1, -1),
+    "b": (-1, 1),
+    "n": (1, 1),
+    ".": None,
+}
+
+
+class Session:
+    """One game of the host, with its queue of pending commands"""
+    def __init__(self, session_id: int, engine: Engine):
+        self.id = session_id
+        self.engine = engine
+        self.inputs: Deque[str] = deque()
+        self.turn = 0
+
+    @property
+    def is_over(self):
+        return not self.engine.player.is_alive
+
+    def get_action(self, command: str) -> Action:
+        move = COMMANDS[command]
+        if move is None:
+            return WaitAction(self.engine.player)
+        return BumpAction(self.engine.player, *move)
+
+    def status(self):
+        player = self.engine.player
+        return f"{self.id} {self.turn} {player.fighter.hp} {player.x} {player.y}"
+
+
+class SessionHost:
+    """Runs many independent games in one process.
+    Every session has its own Engine and GameMap, while the prototypes of entity_factories and the
+    tile_types palette are shared: the maps use PaletteTiles, so a session only stores a byte per tile.
+    Input is queued per session and each tick plays at most one turn of every session with input.
+
+    Line protocol of the local socket server:
+        new [seed]          -> "<session id>"
+        <session id> <cmd>  -> "<session id> <turn> <hp> <x> <y>" once the turn is played,
+                               followed by "<session id> over" once the player is dead.
+                               The session is then closed, its pending commands are dropped
+                               and its later commands are answered with an error.
+    """
+    def __init__(self, params: LevelParams = LevelParams(), max_pending_inputs: int = 16):
+        self.params = params
+        self.max_pending_inputs = max_pending_inputs
+        self.sessions: Dict[int, Session] = {}
+        self._ids = itertools.count(1)
+        self._ready: Deque[Session] = deque()  # Sessions with pending input, in arrival order
+        self._writers: Dict[int, asyncio.StreamWriter] = {}
+
+    @staticmethod
+    def build_player() -> Actor:
+        """Returns a new player held in an EntityStore of its own instead of the shared detached_store.
+        Must run on the event loop thread, since building and moving it allocate and release detached_store slots.
+        """
+        player = entity_factories.player.build()
+        player.attach_store(EntityStore())
+        return player
+
+    def create_engine(self, player: Actor, seed: Optional[int] = None):
+        """Returns the Engine of a new game of the player, with its dungeon generated.
+        The player comes from build_player, so generation moves it from its own store into the new map's store
+        and touches no shared EntityStore: it can run in an executor while the host keeps ticking.
+        """
+        engine = Engine(player)
+        engine.game_map = generate_dungeon(
+            *self.params, engine, seed=seed, tiles=PaletteTiles(self.params.map_width, self.params.map_height)
+        )
+        engine.update_fov()
+        return engine
+
+    def add_session(self, engine: Engine):
+        """Starts a session of the game of the engine and returns it"""
+        session = Session(next(self._ids), engine)
+        self.sessions[session.id] = session
+        return session
+
+    def create_session(self, seed: Optional[int] = None):
+        """Starts a new game and returns its session"""
+        return self.add_session(self.create_engine(self.build_player(), seed))
+
+    def close_session(self, session_id: int):
+        self.sessions.pop(session_id, None)
+        self._writers.pop(session_id, None)
+
+    def submit(self, session_id: int, command: str):
+        """Queues a command of the session, raises ValueError for invalid input"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ValueError(f"Session {session_id} is closed")
+        if command not in COMMANDS:
+            raise ValueError(f"Unknown command {command!r}")
+        if len(session.inputs) >= self.max_pending_inputs:
+            raise ValueError("Too many pending commands")
+        if not session.inputs:
+            self._ready.append(session)
+        session.inputs.append(command)
+
+    def tick(self) -> List[Session]:
+        """Plays one turn of every session with pending input.
+        Returns the sessions which played, and the ones with input whose game is over, whose input is dropped.
+        """
+        played = []
+        for _ in range(len(self._ready)):
+            session = self._ready.popleft()
+            if session.id not in self.sessions:
+                continue  # Closed while its input was pending
+            command = session.inputs.popleft()
+            if not session.is_over:
+                session.engine.take_turn(session.get_action(command))
+                session.turn += 1
+            played.append(session)
+            if session.is_over:
+                session.inputs.clear()
+            elif session.inputs:
+                self._ready.append(session)
+        return played
+
+    async def run(self, tick_interval: float = 0.005):
+        """Ticks forever, sending the status of the sessions which played to their clients.
+        The sessions whose player died are closed after their final status.
+        """
+        while True:
+            for session in self.tick():
+                writer = self._writers.get(session.id)
+                if writer:
+                    writer.write(f"{session.status()}\n".encode())
+                    if session.is_over:
+                        writer.write(f"{session.id} over\n".encode())
+                if session.is_over:
+                    self.close_session(session.id)
+            await asyncio.sleep(tick_interval)
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Reads protocol lines of one client connection"""
+        owned = []
+        try:
+            while line := await reader.readline():
+                words = line.decode().split()
+                try:
+                    if words and words[0] == "new":
+                        seed = int(words[1]) if len(words) > 1 else None
+                        # Generation takes long, the other sessions keep playing meanwhile.
+                        engine = await asyncio.get_running_loop().run_in_executor(
+                            None, self.create_engine, self.build_player(), seed
+                        )
+                        session = self.add_session(engine)
+                        self._writers[session.id] = writer
+                        owned.append(session.id)
+                        writer.write(f"{session.id}\n".encode())
+                    elif len(words) == 2 and int(words[0]) in owned:
+                        self.submit(int(words[0]), words[1])
+                    else:
+                        raise ValueError("Invalid request")
+                except (KeyError, ValueError) as error:
+                    writer.write(f"error {error}\n".encode())
+                await writer.drain()
+        finally:
+            for session_id in owned:
+                self.close_session(session_id)
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 7777):
+        """Serves the line protocol on a local socket while running the tick loop"""
+        server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hosts many games in one process over a local socket.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    args = parser.parse_args()
+    asyncio.run(SessionHost().serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""In-memory snapshots of a running game, restored in place into the Engine they were taken from"""
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from entity_store import FIELDS
+from input_handlers import GameOverEventHandler, MainGameEventHandler
+from message_log import Message
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from entity import Entity
+    from game_map import GameMap
+    from message_log import MessageLog
+    from turn_scheduler import TurnScheduler
+
+# (name, AI or None, attributes of the AI) of an entity.
+Record = Tuple[str, Any, Dict[str, Any]]
+
+
+def _copy_state(state: Dict[str, Any]):
+    """Copies the attributes of an AI, with its lists (paths) copied so they can be changed independently"""
+    return {name: list(value) if isinstance(value, list) else value for name, value in state.items()}
+
+
+def _get_record(entity: Entity) -> Record:
+    ai = getattr(entity, "ai", None)
+    return entity.name, ai, _copy_state(vars(ai)) if ai else {}
+
+
+def _set_record(entity: Entity, record: Record):
+    name, ai, ai_state = record
+    entity.name = name
+    if ai is not None:
+        vars(ai).update(_copy_state(ai_state))
+        entity.ai = ai
+    elif hasattr(entity, "ai"):
+        entity.ai = None
+
+
+class Timeline:
+    """
+    The snapshots of one map in the order they were taken, and a mirror of the store rows and entity
+    records as of one of them, the one at position. The mirror is the only full copy of the state,
+    each snapshot only keeps the slots and entities which changed since the one before it.
+    The messages added since the first snapshot are kept once, by the index they were added at.
+    """
+    def __init__(self, game_map: GameMap, message_log: MessageLog):
+        store = game_map.store
+        self.store_size = store.size
+        self.entities_by_slot = {entity._slot: entity for entity in game_map.entities}
+        self.columns = {name: getattr(store, name)[:store.size].copy() for name, _, _ in FIELDS}
+        self.records: Dict[Entity, Record] = {entity: _get_record(entity) for entity in game_map.entities}
+        self.snapshots: List[Snapshot] = []
+        self.position = 0
+        # The last message of a snapshot can still stack, so the messages start with it.
+        self.messages_start = max(message_log.end - 1, 0)
+        self.messages: List[Optional[Message]] = []
+
+    def record_messages(self, message_log: MessageLog, start: int):
+        """Records the messages of the log from index start on, in place of the ones recorded there"""
+        del self.messages[start - self.messages_start:]
+        self.messages.extend(message_log.get_added_message(index) for index in range(start, message_log.end))
+
+    def get_changed_slots(self, game_map: GameMap) -> np.ndarray:
+        """Returns the slots whose store rows differ from the mirror"""
+        store = game_map.store
+        changed = np.zeros(self.store_size, dtype=bool)
+        for name, column in self.columns.items():
+            different = getattr(store, name)[:self.store_size] != column
+            changed |= different.any(axis=1) if different.ndim > 1 else different
+        return np.flatnonzero(changed)
+
+    def move_to(self, position: int) -> Tuple[np.ndarray, Set[Entity]]:
+        """Moves the mirror to the state of the snapshot at position, walking the deltas in between.
+        Returns the slots and the entities it has changed.
+        """
+        slots: List[np.ndarray] = [np.zeros(0, dtype=np.intp)]
+        entities: Set[Entity] = set()
+        if position > self.position:
+            deltas = [(snapshot.slots, snapshot.rows_after, snapshot.records_after)
+                      for snapshot in self.snapshots[self.position + 1:position + 1]]
+        else:
+            deltas = [(snapshot.slots, snapshot.rows_before, snapshot.records_before)
+                      for snapshot in reversed(self.snapshots[position + 1:self.position + 1])]
+        for delta_slots, rows, records in deltas:
+            for name, column in self.columns.items():
+                column[delta_slots] = rows[name]
+            self.records.update(records)
+            slots.append(delta_slots)
+            entities.update(records)
+        self.position = position
+        return np.unique(np.concatenate(slots)), entities
+
+
+class Snapshot:
+    """
+    State of the game map of an engine at one moment, delta encoded against a parent snapshot:
+    only the store rows and the entity records which changed since the parent are kept, by slot.
+    The tiles don't change during play and are never captured. Neither is the explored mask, the
+    snapshot only keeps its position in the explored log of the map, nor the message log, the snapshot only
+    keeps the index of its end and a copy of its last message, the one which can still stack.
+    Taking and restoring a snapshot only walk the slots which changed, found by comparing the store with
+    one mirror shared by the snapshots, and the entities whose AI acted, tracked in GameMap.acted.
+    Restoring assumes no entity was added to or removed from the map since the snapshot.
+    Restoring a snapshot makes the ones taken after it invalid, unless the same turns are played again as in a replay.
+    A snapshot without a parent starts over and makes all the earlier snapshots of the map invalid.
+    Messages dropped from a log without a spill file can't be restored: rolling back past more than its
+    capacity of messages leaves the log shorter than it was.
+    """
+    def __init__(self, engine: Engine, parent: Optional[Snapshot] = None):
+        game_map = engine.game_map
+        if parent is not None and (
+                parent.game_map is not game_map or not parent.is_valid or parent.timeline.store_size != game_map.store.size
+        ):
+            parent = None
+        self.game_map = game_map
+        message_log = engine.message_log
+        self.message_end = message_log.end
+
+        if parent is None:
+            self.timeline = game_map.snapshot_timeline = Timeline(game_map, message_log)
+            synced_end = self.message_end
+            self.index = 0
+            self.slots = np.zeros(0, dtype=np.intp)
+            self.rows_before = self.rows_after = {}
+            self.records_before: Dict[Entity, Record] = {}
+            self.records_after: Dict[Entity, Record] = {}
+        else:
+            self.timeline = timeline = parent.timeline
+            self.index = parent.index + 1
+            # The live log matches the recorded messages up to the last message of the snapshot it was last in
+            # sync with, or of the parent.
+            synced_end = min(timeline.snapshots[timeline.position].message_end, parent.message_end)
+            moved_slots, moved_entities = timeline.move_to(parent.index)
+            store = game_map.store
+
+            self.slots = timeline.get_changed_slots(game_map)
+            self.rows_before = {name: column[self.slots] for name, column in timeline.columns.items()}
+            self.rows_after = {name: getattr(store, name)[self.slots] for name in timeline.columns}
+            for name, column in timeline.columns.items():
+                column[self.slots] = self.rows_after[name]
+
+            self.records_before = {}
+            self.records_after = {}
+            for entity in self._get_entities(self.slots, moved_slots, moved_entities):
+                record = _get_record(entity)
+                if record != timeline.records[entity]:
+                    self.records_before[entity] = timeline.records[entity]
+                    self.records_after[entity] = timeline.records[entity] = record
+            # The later snapshots are not on the path of this one anymore.
+            del timeline.snapshots[self.index:]
+        self.timeline.record_messages(message_log, max(synced_end - 1, self.timeline.messages_start))
+        self.timeline.snapshots.append(self)
+        self.timeline.position = self.index
+        game_map.acted.clear()
+
+        # Shared with the parent while no actor was added, removed or had its awake flag changed.
+        scheduler = game_map.scheduler
+        if parent is not None and self._same_schedule(parent.scheduler, scheduler):
+            self.scheduler = parent.scheduler
+        else:
+            self.scheduler = scheduler.copy()
+        self.explored_mark = game_map.explored_mark
+        # Outside of the window of the last FOV update nothing is visible.
+        self.fov_window = game_map.fov_window
+        self.visible = game_map.visible[self.fov_window].copy() if self.fov_window is not None else None
+
+        # Only the last message can still change, by stacking, the others are recorded in the timeline.
+        self.last_message = self._copy_message(message_log.messages[-1]) if message_log.messages else None
+
+    @property
+    def is_valid(self):
+        """False once a later snapshot without a parent, or with an earlier parent, has replaced this one"""
+        timeline = self.timeline
+        return (
+            self.game_map.snapshot_timeline is timeline
+            and self.index < len(timeline.snapshots)
+            and timeline.snapshots[self.index] is self
+        )
+
+    def _get_entities(self, *groups: Iterable) -> Set[Entity]:
+        """Returns the entities whose records may have changed: the entities of the slots and entities in the
+        groups, and the ones whose AI acted. Deaths and the other changes of names change the store rows too.
+        """
+        entities_by_slot = self.timeline.entities_by_slot
+        entities = set(self.game_map.acted)
+        for group in groups:
+            if isinstance(group, np.ndarray):
+                entities.update(entities_by_slot[slot] for slot in group.tolist())
+            else:
+                entities.update(group)
+        return entities
+
+    @staticmethod
+    def _same_schedule(scheduler: TurnScheduler, other: TurnScheduler):
+        count = len(scheduler)
+        return scheduler.actors == other.actors and np.array_equal(scheduler.awake[:count], other.awake[:count])
+
+    @staticmethod
+    def _copy_message(message: Message):
+        copy = Message(message.plain_text, message.fg)
+        copy.count = message.count
+        return copy
+
+    def restore(self, engine: Engine):
+        """Puts the game of the engine back into the state of this snapshot"""
+        game_map = self.game_map
+        store = game_map.store
+        timeline = self.timeline
+        if engine.game_map is not game_map:
+            raise ValueError("The snapshot was taken on another map")
+        if store.size != timeline.store_size:
+            raise ValueError("Entities were added to the map since the snapshot")
+        if not self.is_valid:
+            raise ValueError("The snapshot was replaced by a later one")
+
+        # The live game differs from the mirror in the slots changed since it was last in sync,
+        # and from this snapshot also in the slots the mirror changes on its way here.
+        changed_slots = timeline.get_changed_slots(game_map)
+        synced_end = timeline.snapshots[timeline.position].message_end
+        moved_slots, moved_entities = timeline.move_to(self.index)
+        slots = np.union1d(changed_slots, moved_slots)
+
+        entities_by_slot = timeline.entities_by_slot
+        entities = [entities_by_slot[slot] for slot in slots.tolist()]
+        old_positions = [(entity.x, entity.y) for entity in entities]
+        for name, column in timeline.columns.items():
+            getattr(store, name)[slots] = column[slots]
+        game_map.reindex_entities(entities, old_positions)
+
+        for entity in self._get_entities(slots, moved_entities):
+            _set_record(entity, timeline.records[entity])
+        game_map.acted.clear()
+        if not self._same_schedule(self.scheduler, game_map.scheduler):
+            game_map.scheduler = self.scheduler.copy()
+
+        # Roll the explored mask back or forward along the explored log.
+        log, mark = game_map.explored_log, game_map.explored_mark
+        for xs, ys in log[self.explored_mark:mark]:
+            game_map.explored[xs, ys] = False
+        for xs, ys in log[mark:self.explored_mark]:
+            game_map.explored[xs, ys] = True
+        game_map.explored_mark = self.explored_mark
+
+        if game_map.fov_window is not None:
+            game_map.visible[game_map.fov_window] = False
+        if self.fov_window is not None:
+            game_map.visible[self.fov_window] = self.visible
+        game_map.fov_window = self.fov_window
+
+        # Cut the log back to the messages it shares with this snapshot, the last of those may have stacked
+        # since, and add the recorded ones up to the end of this snapshot.
+        message_log = engine.message_log
+        message_log.truncate(max(min(synced_end, self.message_end) - 1, timeline.messages_start))
+        for index in range(message_log.end, self.message_end - 1):
+            message = timeline.messages[index - timeline.messages_start]
+            if message is None:
+                # Dropped without a spill file before it was recorded, it would have pushed the older ones out too.
+                message_log.messages.clear()
+                message_log.dropped = index + 1
+            else:
+                message_log.append(message)
+        if self.last_message is not None and message_log.end < self.message_end:
+            message_log.append(self._copy_message(self.last_message))
+
+        engine._player_distance = None
+        if engine.player.is_alive:
+            engine.event_handler = MainGameEventHandler(engine)
+        else:
+            engine.event_handler = GameOverEventHandler(engine)
@@ -0,0 +1,150 @@
+"""Tile storages which keep a tile_types.palette id per cell instead of a whole tile_dt record"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, Tuple, Union
+
+import numpy as np
+
+import tile_types
+
+
+def _axis_index(key, size: int):
+    """Returns the cell coordinates selected along one axis by an int, slice or integer array"""
+    if isinstance(key, slice):
+        return np.arange(*key.indices(size)), True
+    return np.asarray(key, dtype=np.intp), False
+
+
+class TileField:
+    """View of one field of the tiles, such as tiles["walkable"], indexed like the field of a tile_dt array"""
+    def __init__(self, tiles: PaletteStorage, name: str):
+        self.tiles = tiles
+        self.name = name
+
+    @property
+    def shape(self):
+        return self.tiles.shape
+
+    def __getitem__(self, key):
+        return tile_types.palette[self.name][self.tiles.get_ids(key)]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:, :], dtype=dtype)
+
+
+class PaletteStorage:
+    """
+    Base of the tile storages keeping a tile_types.palette id per cell.
+    Supports the indexing the game uses on tile_dt arrays: tiles["field"][index], tiles[index] and
+    tiles[index] = tile, where index is a pair of ints, slices or integer arrays, or a boolean mask.
+    """
+    width: int
+    height: int
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def get_ids(self, key) -> np.ndarray:
+        """Returns the tile ids of the cells selected by key"""
+        raise NotImplementedError()
+
+    def set_ids(self, key, ids):
+        raise NotImplementedError()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return TileField(self, key)
+        return tile_types.palette[self.get_ids(key)]
+
+    def __setitem__(self, key, tiles):
+        self.set_ids(key, tile_types.get_tile_ids(tiles))
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:, :], dtype=dtype)
+
+
+class PaletteTiles(PaletteStorage):
+    """
+    Tile ids of a map held in memory, one uint8 per cell instead of a 22 byte tile_dt record.
+    The walkable and transparent masks are looked up from the palette for the whole map once,
+    cached, and patched on tile writes. The graphics are looked up only for the cells being read,
+    so they never take memory for the whole map.
+    """
+    cached_fields = ("walkable", "transparent")
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.ids = np.zeros((width, height), dtype=np.uint8, order="F")  # 0 is the wall
+        self._fields: Dict[str, np.ndarray] = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str) and key in self.cached_fields:
+            if key not in self._fields:
+                self._fields[key] = np.asfortranarray(tile_types.palette[key][self.ids])
+            return self._fields[key]
+        return super().__getitem__(key)
+
+    def get_ids(self, key):
+        return self.ids[key]
+
+    def set_ids(self, key, ids):
+        self.ids[key] = ids
+        for name, field in self._fields.items():
+            field[key] = tile_types.palette[name][self.ids[key]]
+
+
+class ChunkedTiles(PaletteStorage):
+    """
+    Tile ids of a map stored in a memory-mapped file, chunk by chunk.
+    Each chunk_size x chunk_size chunk is contiguous in the file, so only the chunks a
+    query touches are paged in, and maps can be far larger than the available memory.
+    The chunks start at offset in the file, so they can also be mapped from inside a save file.
+    """
+    def __init__(
+            self, path: Path | str, width: int, height: int, chunk_size: int = 64, mode: str = "r+", offset: int = 0
+    ):
+        self.path = Path(path)
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        chunks_shape = (-(-width // chunk_size), -(-height // chunk_size), chunk_size, chunk_size)
+        self.ids = np.memmap(self.path, dtype=np.uint8, mode=mode, offset=offset, shape=chunks_shape)
+
+    @classmethod
+    def create(cls, path: Path | str, width: int, height: int, chunk_size: int = 64):
+        """Creates a new file of wall tiles. The file is sparse, so unused chunks take no disk space either"""
+        return cls(path, width, height, chunk_size, mode="w+")
+
+    def _cell_index(self, key):
+        """Returns the index into self.ids of the cells selected by key"""
+        if isinstance(key, np.ndarray) and key.dtype == bool:
+            xs, ys = np.nonzero(key)
+        else:
+            if not isinstance(key, tuple):
+                key = key, slice(None)
+            key_x, key_y = key
+            xs, x_is_slice = _axis_index(key_x, self.width)
+            ys, y_is_slice = _axis_index(key_y, self.height)
+            if x_is_slice and y_is_slice:
+                xs, ys = xs[:, None], ys[None, :]  # Outer product, like slicing a 2D array
+            elif (x_is_slice and ys.ndim) or (y_is_slice and xs.ndim):
+                raise IndexError("Mixing a slice with an index array is not supported")
+        size = self.chunk_size
+        return xs // size, ys // size, xs % size, ys % size
+
+    def get_ids(self, key):
+        return self.ids[self._cell_index(key)]
+
+    def set_ids(self, key, ids):
+        self.ids[self._cell_index(key)] = ids
+
+    def flush(self):
+        """Writes the changed chunks back to the file"""
+        self.ids.flush()
+
+
+# Anything GameMap.tiles can be: a tile_dt array or a palette based storage.
+TileArray = Union[np.ndarray, PaletteStorage]
@@ -48,3 +48,29 @@ wall = new_tile(
     light=(ord(" "), (255, 255, 255), (130, 110, 50))
 )
 
+# Every tile type, indexed by tile id. Tile storages which keep one small id per cell instead of a
+# whole tile_dt record look the tiles up here. Only append new tile types, stored maps refer to them by id.
+# The wall must stay at id 0, new tile storages are zero filled.
+palette = np.array([wall, floor], dtype=tile_dt)
+# Palette id of every tile type, keyed by the bytes of its record.
+_palette_ids = {tile.tobytes(): tile_id for tile_id, tile in enumerate(palette)}
+
+
+def get_tile_ids(tiles: np.ndarray) -> np.ndarray:
+    """Returns the palette ids of the tile or array of tiles"""
+    tiles = np.asarray(tiles, dtype=tile_dt)
+    if tiles.ndim == 0:
+        # A single tile, such as a whole area being carved into floor, is looked up without comparing fields.
+        tile_id = _palette_ids.get(tiles.tobytes())
+        if tile_id is None:
+            raise ValueError("Tile is not in the tile_types palette")
+        return np.uint8(tile_id)
+    ids = np.zeros(tiles.shape, dtype=np.uint8)
+    found = np.zeros(tiles.shape, dtype=bool)
+    for tile_id, tile in enumerate(palette):
+        matches = tiles == tile
+        ids[matches] = tile_id
+        found |= matches
+    if not found.all():
+        raise ValueError("Tile is not in the tile_types palette")
+    return ids
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from enum import IntEnum
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from entity import Actor
+    from game_map import GameMap
+
+
+class ActorState(IntEnum):
+    """What an actor has to do this turn, as decided by the TurnScheduler"""
+    IDLE = 0  # The player can't see the actor.
+    MELEE = 1  # The player can see the actor and stands next to it.
+    CHASE = 2  # The player can see the actor but is too far away to attack.
+
+
+class TurnScheduler:
+    """
+    Keeps the EntityStore slots of the living actors of a GameMap in a NumPy array,
+    so each enemy turn all of them can be triaged in one vectorized pass.
+    Only the actors that have something to do reach the Python-level AI code.
+    """
+    def __init__(self, game_map: GameMap, capacity: int = 64):
+        self.game_map = game_map
+        self.actors: List[Actor] = []
+        self.slots: Dict[Actor, int] = {}
+        self.store_slots = np.zeros(capacity, dtype=np.intp)
+        # True for the actors whose AI has to act even when the player can't see them.
+        self.awake = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return len(self.actors)
+
+    def add(self, actor: Actor):
+        """Starts scheduling the actor"""
+        if actor in self.slots:
+            return
+        slot = len(self.actors)
+        if slot == len(self.store_slots):
+            self.store_slots = np.resize(self.store_slots, slot * 2)
+            self.awake = np.resize(self.awake, slot * 2)
+        self.actors.append(actor)
+        self.slots[actor] = slot
+        self.store_slots[slot] = actor._slot
+        self.awake[slot] = actor.ai.is_awake
+
+    def remove(self, actor: Actor):
+        """Stops scheduling the actor, the last actor takes over its slot"""
+        slot = self.slots.pop(actor, None)
+        if slot is None:
+            return
+        last = self.actors.pop()
+        if last is not actor:
+            self.actors[slot] = last
+            self.slots[last] = slot
+            self.store_slots[slot] = self.store_slots[len(self.actors)]
+            self.awake[slot] = self.awake[len(self.actors)]
+
+    def copy(self):
+        """Returns an independent copy of this scheduler, scheduling the actors in the same order"""
+        clone = TurnScheduler(self.game_map, capacity=0)
+        clone.actors = list(self.actors)
+        clone.slots = dict(self.slots)
+        clone.store_slots = self.store_slots.copy()
+        clone.awake = self.awake.copy()
+        return clone
+
+    def update_awake(self, actor: Actor):
+        """Updates the awake flag of the actor after its AI has acted"""
+        slot = self.slots.get(actor)
+        if slot is not None:
+            self.awake[slot] = actor.ai.is_awake
+
+    def triage(self, player: Actor) -> List[Tuple[Actor, ActorState]]:
+        """Returns the actors which have to act this turn, together with their state.
+        Actors the player can't see and whose AI is not awake are left out.
+        """
+        count = len(self.actors)
+        store_slots = self.store_slots[:count]
+        x = self.game_map.store.x[store_slots]
+        y = self.game_map.store.y[store_slots]
+
+        visible = self.game_map.visible[x, y]
+        distance = np.maximum(np.abs(x - player.x), np.abs(y - player.y))
+        states = np.where(visible, np.where(distance <= 1, ActorState.MELEE, ActorState.CHASE), ActorState.IDLE)
+
+        acting = visible | self.awake[:count]
+        player_slot = self.slots.get(player)
+        if player_slot is not None:
+            acting[player_slot] = False
+
+        return [(self.actors[slot], ActorState(states[slot])) for slot in np.flatnonzero(acting)]